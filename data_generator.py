@@ -1,35 +1,46 @@
 import os
+import time
 import argparse
-from pathlib import Path
+import multiprocessing
 import gc
 import numpy as np
 import yaml
 from lib.tools import (
-    computeTranslationVector,
-    writeFeatures,
+    normalizeVertices,
+    writeFeaturesStream,
     writeMeshPLY,
     rotation_matrix_from_vectors,
     get_files_from_input_path,
     output_name_converter,
     remove_by_filename,
     writeJSON,
-    loadMeshPLY,
+    loadJSON,
+    readMeshPLY,
     loadFeatures,
     create_dirs,
     list_files,
     compareDictsWithTolerance)
 from lib.generate_gmsh import processGMSH
 from lib.generate_pythonocc import processPythonOCC
-from lib.generate_statistics import generateStatistics, generateStatisticsOld
-
-from asGeometryOCCWrapper.curves import CurveFactory
-from asGeometryOCCWrapper.surfaces import SurfaceFactory
+from lib.generate_mesh_occ import getMeshParameters, getHashedMeshParameters
+from lib.generate_statistics import generateStatisticsOld, computeStatistics, \
+    featuresToIndexArrays, columnarToIndexArrays, geometriesToIndexArrays, computeLabels
+from lib.columnar import loadColumnarArrays
+from lib.submesh import SubmeshView
+from lib.pipeline import OrderedWriter, prefetchFile
+from lib.instrumentation import startInstrumentation, stopInstrumentation, RunLog
+from lib.dataset_statistics import updateDatasetStatistics
+from lib.process_runner import runIsolated, TASK_DONE, TASK_ERROR
+from lib.cache import hashFileWithEntry, computeModelKey
+from lib.manifest import Manifest
+from lib.shards import ShardWriter
+from tqdm import tqdm
 
 import open3d as o3d
 
 CAD_FORMATS = ['.step', '.stp', '.STEP']
 MESH_FORMATS = ['.ply', '.PLY']
-FEATURES_FORMATS = ['.pkl', '.PKL', '.yml', '.yaml', '.YAML', '.json', '.JSON']
+FEATURES_FORMATS = ['.pkl', '.PKL', '.yml', '.yaml', '.YAML', '.json', '.JSON', '.npz', '.NPZ']
 STATS_FORMATS = [".json", ".JSON"]
 
 def parse_opt():
@@ -40,12 +51,38 @@ def parse_opt():
     parser.add_argument('--meta_path', type=str, default='', help="Path to the directory containing metadata information such as file URLs, author names, vertical up axis of the model, and model type (large or small plant and large or small part)")
     parser.add_argument('--use_highest_dim', action='store_true', help='Boolean flag to indicate whether to use the highest dimension of the input CAD as reference or not')
     parser.add_argument('--delete_old_data', action='store_true', help='Boolean flag indicating whether to delete old data in the output directory')
+    parser.add_argument('--manifest_commit_interval', type=int, default=50, help='Number of processed models between two commits of the dataset manifest')
     parser.add_argument('--verbose', action='store_true', help='Boolean flag indicating whether to run the code in debug mode.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to generate the models (or to compute the statistics with --only_stats) in parallel')
+    parser.add_argument('--timeout', type=float, default=0., help='Maximum time in seconds to process one model, the model is killed and quarantined when it is exceeded (0 to disable)')
+    parser.add_argument('--max_rss', type=float, default=0., help='Maximum resident memory in MB to process one model, the model is killed and quarantined when it is exceeded (0 to disable)')
+    parser.add_argument('--compact', action='store_true', help='Boolean flag indicating whether to use float32 vertices and parameters and int32 indices in the pipeline and in the written outputs, halving their size')
+    parser.add_argument('--pipelined', action='store_true', help='Boolean flag indicating whether to write the outputs of each model in a background thread while the next model is read and meshed, prefetching the next input file (serial processing only, not with --workers, --timeout, --max_rss, --face_workers or --solid_workers)')
+    parser.add_argument('--write_queue', type=int, default=1, help='Maximum number of processed models waiting to be written when using --pipelined')
+    parser.add_argument('--retry_quarantined', action='store_true', help='Boolean flag indicating whether to process again the models in the quarantine list')
 
     # Mesh parser general
     mesh_parser = parser.add_argument_group("Mesh arguments")
     mesh_parser.add_argument("--mesh_generator", type=str, default="occ", choices=["occ", "gmsh"], help="Name of the mesh generator to use")
     mesh_parser.add_argument('--mesh_folder', type=str, default="mesh", help='Path to the folder where the mesh will be saved')
+    mesh_parser.add_argument('--mesh_labels', action='store_true', help='Boolean flag indicating whether to write in the PLY files the surface of each triangle (surface_id) and the curve of each vertex (curve_id), -1 for none')
+    mesh_parser.add_argument('--face_workers', type=int, default=1, help='Number of processes used to read the face triangulations of each model in parallel (OCC mesh generator only)')
+
+    # OCC parser general
+    occ_parser = parser.add_argument_group("OCC arguments")
+    occ_parser.add_argument('--occ_angle', type=float, default=None, help='Angular deflection in radians of the OCC mesh (default 0.1)')
+    occ_parser.add_argument('--occ_deflection', type=float, default=None, help='Linear deflection of the OCC mesh (default 0.01), relative to the edge size unless --occ_absolute is used')
+    occ_parser.add_argument('--occ_min_size', type=float, default=None, help='Minimum size of the OCC mesh elements (default 0.01)')
+    occ_parser.add_argument('--occ_absolute', action='store_true', help='Boolean flag indicating whether the OCC deflection is absolute (in mm) instead of relative')
+    occ_parser.add_argument('--occ_sequential', action='store_true', help='Boolean flag indicating whether to disable the parallel OCC meshing of the faces')
+    occ_parser.add_argument('--tessellation_cache_dir', type=str, default='', help='Path to the directory of the persistent OCC tessellation cache (empty to disable)')
+    occ_parser.add_argument('--tessellation_cache_size', type=float, default=10240, help='Maximum size in MB of the tessellation cache, least recently used meshes are evicted (0 for no limit)')
+    occ_parser.add_argument('--shape_cache_dir', type=str, default='', help='Path to the directory of the healed shape cache, used to skip STEP reading and healing (empty to disable)')
+    occ_parser.add_argument('--shape_cache_size', type=float, default=10240, help='Maximum size in MB of the healed shape cache, least recently used shapes are evicted (0 for no limit)')
+    occ_parser.add_argument('--split_solids', action='store_true', help='Boolean flag indicating whether to mesh and map each group of solids on its own, bounding the memory by the largest group (solids sharing faces or edges are kept in the same group)')
+    occ_parser.add_argument('--solids_per_group', type=int, default=1, help='Number of solids per group when using --split_solids')
+    occ_parser.add_argument('--solid_workers', type=int, default=1, help='Number of processes used to mesh the solid groups in parallel when using --split_solids')
+    occ_parser.add_argument('--triangle_budget', type=int, default=0, help='Approximate number of triangles per model, the OCC deflection is coarsened to reach it (0 to disable)')
 
     # Gmsh parser general
     gmsh_parser = parser.add_argument_group("GMSH arguments")
@@ -54,14 +91,312 @@ def parse_opt():
     # Feature parser general
     feature_parser = parser.add_argument_group("Feature arguments")
     feature_parser.add_argument('--features_folder', type=str, default="features", help='Path to the folder containing the features to be extracted')
-    feature_parser.add_argument('--features_file_type', type=str, default='pkl', choices=["pkl", "json", "yaml"], help='The file type of the features')
+    feature_parser.add_argument('--features_file_type', type=str, default='pkl', choices=["pkl", "json", "yaml", "npz"], help='The file type of the features (npz is a columnar layout with flat index arrays, faster to write and load)')
 
     # Stats parser general
     stats_parser = parser.add_argument_group("Stats arguments")
     stats_parser.add_argument('--stats_folder', type=str, default="stats", help='Path to the folder where statistics will be saved')
     stats_parser.add_argument('--only_stats', action='store_true', help='Boolean flag indicating whether to only generate statistics without processing the data.')
-
-    return parser.parse_args()
+    stats_parser.add_argument('--run_logs_folder', type=str, default='run_logs', help='Path to the folder where the timings of each stage (STEP read, ShapeFix, BRepMesh, mesh mapping, normalization, statistics, writers) and the counters (nodes, triangles, canceled degenerate faces, void entities) of every model are saved, one JSONL and CSV file per run (empty to disable)')
+    stats_parser.add_argument('--dataset_stats', action='store_true', help='Boolean flag indicating whether to update the dataset statistics report (type histograms, void rates, area and triangle count distributions) with the models processed since the last update')
+
+    # Shards parser general
+    shards_parser = parser.add_argument_group("Shards arguments")
+    shards_parser.add_argument('--shards_folder', type=str, default='', help='Path to the folder where the models are also packed, as they finish, into large shard files with an offset index for random access by name (empty to disable)')
+    shards_parser.add_argument('--shard_size', type=float, default=1024., help='Size in MB after which a new shard file is started')
+
+    args = parser.parse_args()
+    # the face and solid pools are forked, forking while the writer and prefetch threads run can deadlock the children
+    if args.pipelined and (args.face_workers > 1 or args.solid_workers > 1):
+        parser.error('--pipelined can not be used with --face_workers or --solid_workers greater than 1')
+    # each model already runs in its own worker process with --workers, --timeout or --max_rss
+    if args.pipelined and (args.workers > 1 or args.timeout > 0 or args.max_rss > 0):
+        parser.error('--pipelined can not be used with --workers greater than 1, --timeout or --max_rss')
+
+    return args
+
+def read_meta(meta_path, output_name, verbose=True):
+    """ Function to read the vertical up axis and the unit scale of a model from its meta file """
+    vertical_up_axis = np.array([0., 0., 1.])
+    unit_scale = 1000
+
+    if meta_path != "":
+        meta_filename = output_name + ".yml"
+        meta_file = os.path.join(meta_path, meta_filename)
+        if os.path.isfile(meta_file):
+            with open(meta_file, "r") as meta_file_object:
+                if verbose:
+                    print("\n[Normalization] Using meta_file")
+                file_info = yaml.load(meta_file_object, Loader=yaml.FullLoader)
+
+                vertical_up_axis = np.array(file_info["vertical_up_axis"]) if \
+                                    "vertical_up_axis" in file_info.keys() or  \
+                                    file_info["vertical_up_axis"] is None \
+                                        else np.array([0., 0., 1.])
+
+                unit_scale = file_info["unit_scale"] if "unit_scale" \
+                                in file_info.keys() else 1000
+
+    return vertical_up_axis, unit_scale
+
+def process_model(file, config, idx=0, total=1):
+    """ Function to read, mesh and normalize one CAD model, returning the outputs to be written """
+    start_time = time.time()
+    # the library functions record their stages and counters in the instrumentation of the current thread
+    instrumentation = startInstrumentation()
+    filename = file.rsplit("/", maxsplit=1)[-1]
+    output_name = output_name_converter(file, CAD_FORMATS)
+
+    mesh_generator = config['mesh_generator']
+    use_highest_dim = config['use_highest_dim']
+    verbose = config['verbose']
+
+    features_name = os.path.join(config['features_folder_dir'], output_name)
+    remove_by_filename(features_name, FEATURES_FORMATS)
+    mesh_name = os.path.join(config['mesh_folder_dir'], output_name)
+    remove_by_filename(mesh_name, MESH_FORMATS)
+    stats_name = os.path.join(config['stats_folder_dir'], output_name)
+    remove_by_filename(stats_name, STATS_FORMATS)
+
+    vertical_up_axis, unit_scale = read_meta(config['meta_path'], output_name)
+    scale_to_mm = 1000/unit_scale
+    unit_scale = 1000
+
+    print(f'\nProcessing file - Model {filename} - [{idx+1}/{total}]:')
+
+    shape, geometries_data, mesh = processPythonOCC(file, generate_mesh=(mesh_generator=="occ"), \
+                                                    use_highest_dim=use_highest_dim, scale_to_mm=scale_to_mm, \
+                                                    mesh_parameters=config['mesh_parameters'], \
+                                                    triangle_budget=config['triangle_budget'], \
+                                                    tessellation_cache=config['tessellation_cache'], \
+                                                    shape_cache=config['shape_cache'], \
+                                                    split_solids=config['split_solids'], \
+                                                    solids_per_group=config['solids_per_group'], \
+                                                    solid_workers=config['solid_workers'], \
+                                                    face_workers=config['face_workers'], \
+                                                    compact=config['compact'], \
+                                                    input_hash=config['input_hashes'].get(output_name), debug=verbose)
+    print("\n[PythonOCC] Done.")
+    if mesh_generator == "gmsh":
+        print('\n[GMSH]:')
+        with instrumentation.stage('gmsh'):
+            features, mesh = processGMSH(input_name=file, mesh_size=config['mesh_size'], \
+                                         features=features, mesh_name=mesh_name, \
+                                            shape=shape, use_highest_dim=use_highest_dim, \
+                                                debug=verbose)
+        print("\n[GMSH] Done.")
+
+    print('\n[Normalization]')
+    R = np.eye(3)
+    t = np.zeros(3)
+    s = 1./unit_scale
+    with instrumentation.stage('normalization'):
+        if len(mesh["vertices"]) > 0:
+            R = rotation_matrix_from_vectors(vertical_up_axis)
+            # rotation, translation and scale fused in one transform, in place (the OCC mesh is already
+            # float32 when compact, only the gmsh one is converted)
+            mesh["vertices"], t = normalizeVertices(mesh["vertices"], R, s, dtype=np.float32 if config['compact'] else None)
+
+        if config['compact']:
+            # the float32/int32 arrays are the global mesh, the open3d mesh is only built when the geometries are bound
+            global_mesh = {'vertices': mesh['vertices'], 'faces': np.asarray(mesh['faces'], dtype=np.int32)}
+            vertices, faces = global_mesh['vertices'], global_mesh['faces']
+        else:
+            #TODO: need to use o3d mesh in whole code
+            global_mesh = o3d.geometry.TriangleMesh()
+            if len(mesh["vertices"]) > 0:
+                global_mesh.vertices = o3d.utility.Vector3dVector(np.asarray(mesh['vertices'], dtype=np.float64))
+                global_mesh.triangles = o3d.utility.Vector3iVector(np.asarray(mesh['faces'], dtype=np.int32))
+            vertices, faces = np.asarray(global_mesh.vertices), np.asarray(global_mesh.triangles)
+
+    del mesh
+    gc.collect()
+
+    # normalizing and adding mesh data
+    transforms = [{'rotation': R}, {'translation': t}, {'scale': s}]
+    # the entities refer to the global mesh by index, the geometries are bound only when they are written
+    with instrumentation.stage('geometry_binding'):
+        for edge_idx in range(len(geometries_data['curves'])):
+            geometries_data['curves'][edge_idx]['geometry'].applyTransforms(transforms)
+
+            mesh_data = geometries_data['curves'][edge_idx]['mesh_data']
+            geometries_data['curves'][edge_idx]['mesh_view'] = SubmeshView(global_mesh, mesh_data)
+
+            del geometries_data['curves'][edge_idx]['mesh_data']
+
+        for face_idx in range(len(geometries_data['surfaces'])):
+            geometries_data['surfaces'][face_idx]['geometry'].applyTransforms(transforms)
+
+            mesh_data = geometries_data['surfaces'][face_idx]['mesh_data']
+            geometries_data['surfaces'][face_idx]['mesh_view'] = SubmeshView(global_mesh, mesh_data)
+
+            del geometries_data['surfaces'][face_idx]['mesh_data']
+
+    print("\n[Normalization] Done.")
+
+    print('\n[Generating statistics]')
+    with instrumentation.stage('statistics'):
+        index_arrays = geometriesToIndexArrays(geometries_data)
+        stats = computeStatistics(index_arrays, vertices, faces)
+    for key in ['number_curves', 'number_surfaces', 'number_void_curves', 'number_void_surfaces']:
+        instrumentation.count(key[len('number_'):], stats.get(key, 0))
+    print("\n[Statistics] Done.")
+
+    vertex_properties, face_properties = None, None
+    if config['mesh_labels']:
+        # ids are the positions of the curves and surfaces in the features file
+        with instrumentation.stage('mesh_labels'):
+            surface_labels, curve_labels = computeLabels(index_arrays, stats['number_vertices'], stats['number_faces'])
+        vertex_properties, face_properties = {'curve_id': curve_labels}, {'surface_id': surface_labels}
+    del index_arrays
+    stopInstrumentation()
+
+    return {
+        'start_time': start_time,
+        'mesh_name': mesh_name,
+        'mesh': global_mesh,
+        'vertex_properties': vertex_properties,
+        'face_properties': face_properties,
+        'features_name': features_name,
+        'geometries_data': geometries_data,
+        'stats_name': stats_name,
+        'stats': stats,
+        'instrumentation': instrumentation,
+    }
+
+def write_model(outputs, config):
+    """ Function to write the outputs of a processed model, returning its statistics, output files and timings """
+    mesh_name, features_name, stats_name = outputs['mesh_name'], outputs['features_name'], outputs['stats_name']
+    # given by the outputs, the writes may run in another thread than the processing
+    instrumentation = outputs['instrumentation']
+
+    print('\n[Writing meshes]')
+    with instrumentation.stage('write_mesh'):
+        writeMeshPLY(mesh_name, outputs['mesh'], vertex_properties=outputs['vertex_properties'], \
+                     face_properties=outputs['face_properties'], compact=config['compact'])
+    print('\n[Writing meshes] Done.')
+
+    print('\n[Writing Features]')
+    # each geometry is converted to its features dict while it is written and released after it
+    with instrumentation.stage('write_features'):
+        writeFeaturesStream(features_name=features_name, geometries_data=outputs['geometries_data'], \
+                            tp=config['features_file_type'], compact=config['compact'])
+    print("\n[Writing Features] Done.")
+
+    print('\n[Writing Statistics]')
+    with instrumentation.stage('write_stats'):
+        writeJSON(stats_name, outputs['stats'])
+    print("\n[Writing Statistics] Done.")
+
+    print('\n[Generator] Process done.')
+
+    result = {
+        'stats': outputs['stats'],
+        'mesh_file': mesh_name + '.ply',
+        'features_file': f"{features_name}.{config['features_file_type']}",
+        'stats_file': stats_name + '.json',
+        'timings': dict(instrumentation.timings, total=time.time() - outputs['start_time']),
+        'counters': dict(instrumentation.counters),
+    }
+    if config['keep_mesh']:
+        # packed in the shards from memory instead of reading the PLY again
+        result['mesh'] = outputs['mesh']
+
+    outputs.clear()
+    gc.collect()
+
+    return result
+
+def generate_model(file, config, idx=0, total=1):
+    """ Function to read, mesh, normalize and write the outputs of one CAD model, returning its statistics,
+    output files and timings """
+    return write_model(process_model(file, config, idx=idx, total=total), config)
+
+def pack_model(shard_writer, output_name, config, mesh=None):
+    """ Function to append the outputs of a generated model to the shard files, with its global mesh when it is
+    still in memory. A model that can not be packed is reported and skipped, it does not stop the generation """
+    try:
+        pack_model_outputs(shard_writer, output_name, config, mesh=mesh)
+    except Exception as error:
+        print(f"\n[Shards] Failed to pack {output_name}: {error!r}")
+        return False
+    return True
+
+def pack_model_outputs(shard_writer, output_name, config, mesh=None):
+    if mesh is None:
+        mesh = readMeshPLY(os.path.join(config['mesh_folder_dir'], output_name))
+    if isinstance(mesh, dict):
+        vertices, faces = mesh['vertices'], mesh['faces']
+    else:
+        vertices, faces = np.asarray(mesh.vertices), np.asarray(mesh.triangles)
+    features_file_type = config['features_file_type']
+    features_name = os.path.join(config['features_folder_dir'], f'{output_name}.{features_file_type}')
+    stats_name = os.path.join(config['stats_folder_dir'], f'{output_name}.json')
+    with open(features_name, 'rb') as f:
+        features_bytes = f.read()
+    with open(stats_name, 'rb') as f:
+        stats_bytes = f.read()
+    # the faces are int32 in both modes, as in the PLY files
+    shard_writer.add(output_name, {
+        'vertices': np.asarray(vertices, dtype=np.float32 if config['compact'] else np.float64),
+        'faces': np.asarray(faces, dtype=np.int32),
+        'features': (features_bytes, features_file_type),
+        'stats': (stats_bytes, 'json'),
+    })
+
+def compute_model_stats(task):
+    """ Function to recompute the statistics of a generated model from its mesh and the index arrays
+    of its features file, without building the geometries """
+    feature_name, config = task
+    stats_name = os.path.join(config['stats_folder_dir'], feature_name)
+    remove_by_filename(stats_name, STATS_FORMATS)
+
+    mesh = readMeshPLY(os.path.join(config['mesh_folder_dir'], feature_name))
+    vertices, faces = mesh['vertices'], mesh['faces']
+
+    features_file_type = config['features_file_type']
+    features_path = os.path.join(config['features_folder_dir'], feature_name)
+    if features_file_type.lower() == 'npz':
+        index_arrays = columnarToIndexArrays(loadColumnarArrays(f'{features_path}.{features_file_type}', mmap=True))
+    else:
+        index_arrays = featuresToIndexArrays(loadFeatures(features_path, features_file_type))
+
+    stats = computeStatistics(index_arrays, vertices, faces)
+    writeJSON(stats_name, stats)
+    return feature_name, stats
+
+def generate_model_task(task):
+    """ Function executed in the isolated worker processes """
+    file, config, idx, total = task
+    return generate_model(file, config, idx=idx, total=total)
+
+def model_config(config, file):
+    """ Function to return the config of one model, holding only its own input hash """
+    output_name = output_name_converter(file, CAD_FORMATS)
+    return dict(config, input_hashes={output_name: config['input_hashes'][output_name]} \
+                if output_name in config['input_hashes'] else {})
+
+def generate_models_isolated(files, config, workers, timeout, max_rss, on_model_done=None):
+    """ Function to process each model in isolated worker processes, returning the failures and
+    the models that were killed (timeout, memory limit) or crashed """
+    failures = []
+    quarantined = []
+    tasks = [(str(file), model_config(config, file), idx, len(files)) for idx, file in enumerate(files)]
+    progress = tqdm(runIsolated(tasks, generate_model_task, workers=workers, timeout=timeout, max_rss=max_rss), \
+                    total=len(tasks), desc='[Generator]')
+    for task, status, payload in progress:
+        file = task[0]
+        if status == TASK_DONE:
+            if on_model_done is not None:
+                on_model_done(file, payload)
+        elif status == TASK_ERROR:
+            failures.append((file, payload))
+        else:
+            print(f"\n[Generator] Quarantining {file}: {status}, {payload}")
+            quarantined.append({'name': output_name_converter(file, CAD_FORMATS), 'file': file, \
+                                'reason': status, 'detail': payload})
+        progress.set_postfix(failed=len(failures), quarantined=len(quarantined))
+    return failures, quarantined
 
 def main():
     """ The main loop of the generator """
@@ -74,13 +409,43 @@ def main():
     meta_path = args.meta_path
     delete_old_data = args.delete_old_data
     verbose = args.verbose
+    workers = args.workers
+    timeout = args.timeout
+    max_rss = args.max_rss
+    retry_quarantined = args.retry_quarantined
+    compact = args.compact
+    pipelined = args.pipelined
+    write_queue = args.write_queue
+    manifest_commit_interval = args.manifest_commit_interval
     # <--- General arguments
 
     # ---> Mesh arguments
     mesh_generator = args.mesh_generator
     mesh_folder = args.mesh_folder
+    face_workers = args.face_workers
+    mesh_labels = args.mesh_labels
     # <--- Mesh arguments
 
+    # ---> OCC arguments
+    mesh_parameters = getMeshParameters({
+        'angle': args.occ_angle,
+        'deflection': args.occ_deflection,
+        'min_size': args.occ_min_size,
+        'relative': not args.occ_absolute,
+        'in_parallel': not args.occ_sequential,
+    })
+    triangle_budget = args.triangle_budget
+    split_solids = args.split_solids
+    solids_per_group = max(args.solids_per_group, 1)
+    solid_workers = args.solid_workers
+    tessellation_cache = None
+    if args.tessellation_cache_dir != '':
+        tessellation_cache = {'dir': args.tessellation_cache_dir, 'max_size': int(args.tessellation_cache_size*2**20)}
+    shape_cache = None
+    if args.shape_cache_dir != '':
+        shape_cache = {'dir': args.shape_cache_dir, 'max_size': int(args.shape_cache_size*2**20)}
+    # <--- OCC arguments
+
     # ---> GMSH arguments
     mesh_size = args.mesh_size
     # <--- GMSH arguments
@@ -93,8 +458,15 @@ def main():
     # ---> Stats arguments
     stats_folder = args.stats_folder
     only_stats = args.only_stats
+    dataset_stats = args.dataset_stats
+    run_logs_folder = args.run_logs_folder
     # <--- Stats arguments
 
+    # ---> Shards arguments
+    shards_folder = args.shards_folder
+    shard_size = int(args.shard_size*2**20)
+    # <--- Shards arguments
+
     # ---> Directories verifications
     files = get_files_from_input_path(input_path)
     
@@ -103,180 +475,195 @@ def main():
     stats_folder_dir = os.path.join(output_path, stats_folder)
     create_dirs(output_path, mesh_folder_dir, features_folder_dir, stats_folder_dir)
 
-    mesh_files = list_files(mesh_folder_dir, MESH_FORMATS, return_str=True)
-    mesh_files = [mesh_file[(mesh_file.rfind('/') + 1):mesh_file.rindex('.')] for mesh_file in mesh_files]
-    features_files = list_files(features_folder_dir, FEATURES_FORMATS, return_str=True)
-    features_files = [f[(f.rfind('/') + 1):f.rindex('.')] for f in features_files]
-    statistics_files = list_files(stats_folder_dir, STATS_FORMATS, return_str=True)
-    statistics_files = [f[(f.rfind('/') + 1):f.rindex('.')] for f in statistics_files]
-
-    i = 0
-    while i < len(files):
-        file_str = str(files[i])
-        filename = file_str[(file_str.rfind('/') + 1):file_str.rindex('.')]
-        if filename in mesh_files and filename in features_files and not delete_old_data:
-            files.pop(i)
-        else:
-            i += 1
+    manifest = Manifest(os.path.join(output_path, 'manifest.sqlite'))
+
+    # a model is regenerated only when its input content or an output-affecting parameter changed
+    manifest_entries = manifest.getEntries()
+    cache_entries = {}
+    model_parameters = {}
+    input_hashes = {}
+    if not only_stats:
+        outdated_files = []
+        for file in tqdm(files, desc='[Cache] Hashing inputs'):
+            output_name = output_name_converter(file, CAD_FORMATS)
+            manifest_entry = manifest_entries.get(output_name)
+            input_hash, entry = hashFileWithEntry(str(file), manifest_entry)
+            vertical_up_axis, unit_scale = read_meta(meta_path, output_name, verbose=False)
+            parameters = {
+                'mesh_generator': mesh_generator,
+                'mesh_size': mesh_size,
+                'mesh_parameters': getHashedMeshParameters(mesh_parameters),
+                'triangle_budget': triangle_budget,
+                'split_solids': split_solids,
+                'solids_per_group': solids_per_group if split_solids else None,
+                'use_highest_dim': use_highest_dim,
+                'vertical_up_axis': np.asarray(vertical_up_axis, dtype=np.float64).tolist(),
+                'unit_scale': unit_scale,
+                'features_file_type': features_file_type,
+                'compact': compact,
+                'mesh_labels': mesh_labels,
+            }
+            entry['key'] = computeModelKey(input_hash, parameters)
+            cache_entries[output_name] = entry
+            input_hashes[output_name] = input_hash
+            model_parameters[output_name] = parameters
+
+            is_cached = manifest_entry is not None and manifest_entry['key'] == entry['key'] and \
+                        all(manifest_entry[f] is not None and os.path.isfile(manifest_entry[f]) \
+                            for f in ['mesh_file', 'features_file'])
+            if delete_old_data or not is_cached:
+                # outputs of a model that fails now must not be taken as up to date later
+                if manifest_entry is not None:
+                    manifest.removeModel(output_name)
+                outdated_files.append(file)
+        manifest.commit()
+        print(f"\n[Cache] {len(files) - len(outdated_files)} of {len(files)} models are up to date.")
+        files = outdated_files
+
+    quarantine_name = os.path.join(output_path, 'quarantine')
+    quarantine = loadJSON(quarantine_name + '.json') if os.path.isfile(quarantine_name + '.json') else []
+    if not retry_quarantined:
+        quarantined_names = set(q['name'] for q in quarantine)
+        files = [f for f in files if output_name_converter(f, CAD_FORMATS) not in quarantined_names]
     # <--- Directories verifications
 
     # ---> Main loop
     if not only_stats:
-        for idx, file in enumerate(files):
-            file = str(file)
-            filename = file.rsplit("/", maxsplit=1)[-1]
+        config = {
+            'meta_path': meta_path,
+            'compact': compact,
+            'mesh_labels': mesh_labels,
+            'use_highest_dim': use_highest_dim,
+            'verbose': verbose,
+            'mesh_generator': mesh_generator,
+            'mesh_size': mesh_size,
+            'mesh_parameters': mesh_parameters,
+            'triangle_budget': triangle_budget,
+            'tessellation_cache': tessellation_cache,
+            'shape_cache': shape_cache,
+            'split_solids': split_solids,
+            'solids_per_group': solids_per_group,
+            'solid_workers': solid_workers,
+            'face_workers': face_workers,
+            'mesh_folder_dir': mesh_folder_dir,
+            'features_folder_dir': features_folder_dir,
+            'features_file_type': features_file_type,
+            'stats_folder_dir': stats_folder_dir,
+            # hashed once when checking the manifest, the shape cache is keyed by them
+            'input_hashes': input_hashes,
+        }
+        # the parent packs the models as they finish, so only one process writes the shards
+        shard_writer = None
+        if shards_folder != '':
+            shard_writer = ShardWriter(os.path.join(output_path, shards_folder), max_shard_size=shard_size)
+        # with isolated children the models are packed in a background thread, not to stall the checks of
+        # the timeout and memory limits (the children are spawned, so no thread is forked)
+        shard_packer = None
+        if shard_writer is not None and (workers > 1 or timeout > 0 or max_rss > 0):
+            shard_packer = OrderedWriter(max_pending=max(len(files), 1))
+        # without isolated children the global mesh of each model is still in memory when it is packed
+        config['keep_mesh'] = shard_writer is not None and shard_packer is None
+
+        run_log = None
+        if run_logs_folder != '':
+            run_logs_folder_dir = os.path.join(output_path, run_logs_folder)
+            create_dirs(run_logs_folder_dir)
+            run_log = RunLog(run_logs_folder_dir)
+
+        done_names = []
+        def on_model_done(file, result):
             output_name = output_name_converter(file, CAD_FORMATS)
-
-            features_name = os.path.join(features_folder_dir, output_name)
-            remove_by_filename(features_name, FEATURES_FORMATS)
-            mesh_name = os.path.join(mesh_folder_dir, output_name)
-            remove_by_filename(mesh_name, MESH_FORMATS)
-            stats_name = os.path.join(stats_folder_dir, output_name)
-            remove_by_filename(stats_name, STATS_FORMATS)
-
-            vertical_up_axis = np.array([0., 0., 1.])
-            unit_scale = 1000
-
-            if meta_path != "":
-                meta_filename = output_name + ".yml"
-                meta_file = os.path.join(meta_path, meta_filename)
-                if os.path.isfile(meta_file):
-                    with open(meta_file, "r") as meta_file_object:
-                        print("\n[Normalization] Using meta_file")
-                        file_info = yaml.load(meta_file_object, Loader=yaml.FullLoader)
-
-                        vertical_up_axis = np.array(file_info["vertical_up_axis"]) if \
-                                            "vertical_up_axis" in file_info.keys() or  \
-                                            file_info["vertical_up_axis"] is None \
-                                                else np.array([0., 0., 1.])
-
-                        unit_scale = file_info["unit_scale"] if "unit_scale" \
-                                        in file_info.keys() else 1000
-                        
-            scale_to_mm = 1000/unit_scale
-            unit_scale = 1000
-
-            print(f'\nProcessing file - Model {filename} - [{idx+1}/{len(files)}]:')
-
-            shape, geometries_data, mesh = processPythonOCC(file, generate_mesh=(mesh_generator=="occ"), \
-                                                            use_highest_dim=use_highest_dim, scale_to_mm=scale_to_mm, \
-                                                            debug=verbose)
-            print("\n[PythonOCC] Done.")
-            if mesh_generator == "gmsh":
-                print('\n[GMSH]:')
-                features, mesh = processGMSH(input_name=file, mesh_size=mesh_size, \
-                                             features=features, mesh_name=mesh_name, \
-                                                shape=shape, use_highest_dim=use_highest_dim, \
-                                                    debug=verbose)
-                print("\n[GMSH] Done.")
-
-            print('\n[Normalization]')
-            R = np.eye(3)
-            t = np.zeros(3)
-            s = 1./unit_scale
-            if len(mesh["vertices"]) > 0:
-                R = rotation_matrix_from_vectors(vertical_up_axis)
-                mesh["vertices"] = (R @ mesh["vertices"].T).T
-                t = computeTranslationVector(mesh["vertices"])
-                mesh["vertices"] += t
-                mesh["vertices"] *= s
-
-            #TODO: need to use o3d mesh in whole code
-            o3d_mesh = o3d.geometry.TriangleMesh()
-            if len(mesh["vertices"]) > 0:
-                o3d_mesh.vertices = o3d.utility.Vector3dVector(np.asarray(mesh['vertices']))
-                o3d_mesh.triangles = o3d.utility.Vector3iVector(np.asarray(mesh['faces']))
-
-            del mesh
-            gc.collect()
-
-            # normalizing and adding mesh data
-            transforms = [{'rotation': R}, {'translation': t}, {'scale': s}]
-            features = {'curves': [], 'surfaces': []}
-            for edge_idx in range(len(geometries_data['curves'])):
-                geometries_data['curves'][edge_idx]['geometry'].applyTransforms(transforms)
-
-                mesh_data = geometries_data['curves'][edge_idx]['mesh_data']
-                geometries_data['curves'][edge_idx]['geometry'].setMeshByGlobal(o3d_mesh, mesh_data)
-
-                del geometries_data['curves'][edge_idx]['mesh_data']
-
-            for face_idx in range(len(geometries_data['surfaces'])):
-                geometries_data['surfaces'][face_idx]['geometry'].applyTransforms(transforms)
-
-                mesh_data = geometries_data['surfaces'][face_idx]['mesh_data']
-                geometries_data['surfaces'][face_idx]['geometry'].setMeshByGlobal(o3d_mesh, mesh_data)
-
-                del geometries_data['surfaces'][face_idx]['mesh_data']
-
-            print("\n[Normalization] Done.")
-
-            print('\n[Generating statistics]')
-            stats = generateStatistics(geometries_data, o3d_mesh)
-            print("\n[Statistics] Done.")
-
-            print('\n[Writing meshes]')
-            writeMeshPLY(mesh_name, o3d_mesh)
-            print('\n[Writing meshes] Done.')
-
-            print('\n[Writing Features]')
-             # creating features dict
-            features = {'curves': [], 'surfaces': []}
-            for edge_data in geometries_data['curves']:
-                if edge_data['geometry'] is not None:
-                    features['curves'].append(dict(edge_data['geometry'].toDict()))
-            for face_data in geometries_data['surfaces']:
-                if face_data['geometry'] is not None:
-                    features['surfaces'].append(dict(face_data['geometry'].toDict()))
-            writeFeatures(features_name=features_name, features=features, tp=features_file_type)
-            print("\n[Writing Features] Done.")
-
-            print('\n[Writing Statistics]')
-            writeJSON(stats_name, stats)
-            print("\n[Writing Statistics] Done.")
-
-            print('\n[Generator] Process done.')
-
-            #del stats
-            del features
-            del o3d_mesh
-            gc.collect()
+            mesh = result.pop('mesh', None)
+            if run_log is not None:
+                run_log.add(output_name, {'status': TASK_DONE, 'timings': result['timings'], 'counters': result['counters']})
+            if shard_packer is not None:
+                shard_packer.submit(output_name, pack_model, shard_writer, output_name, config)
+            elif shard_writer is not None:
+                pack_model(shard_writer, output_name, config, mesh=mesh)
+            manifest.setModel(output_name, cache_entries[output_name], model_parameters[output_name], result)
+            done_names.append(output_name)
+            if len(done_names) % manifest_commit_interval == 0:
+                manifest.commit()
+
+        if workers > 1 or timeout > 0 or max_rss > 0:
+            failures, quarantined = generate_models_isolated(files, config, workers, timeout, max_rss*2**20, \
+                                                             on_model_done=on_model_done)
+            print(f"\nDone. {len(files) - len(failures) - len(quarantined)} of {len(files)} were processed.")
+            for file, error in failures:
+                print(f"\n[Generator] Failed to process {file}:\n{error}")
+                if run_log is not None:
+                    run_log.add(output_name_converter(file, CAD_FORMATS), {'status': TASK_ERROR})
+            if run_log is not None:
+                for q in quarantined:
+                    run_log.add(q['name'], {'status': q['reason']})
+
+            processed_names = set(output_name_converter(f, CAD_FORMATS) for f in files)
+            quarantine = [q for q in quarantine if q['name'] not in processed_names] + quarantined
+            writeJSON(quarantine_name, quarantine)
+        elif pipelined:
+            # model N is written in the background while model N + 1 is read and meshed
+            writer = OrderedWriter(max_pending=write_queue)
+            try:
+                for idx, file in enumerate(files):
+                    if idx + 1 < len(files):
+                        prefetchFile(str(files[idx + 1]))
+                    outputs = process_model(str(file), config, idx=idx, total=len(files))
+                    writer.submit(str(file), write_model, outputs, config)
+                    del outputs
+                    for done_file, result in writer.completed():
+                        on_model_done(done_file, result)
+            finally:
+                writer.close()
+                for done_file, result in writer.completed():
+                    on_model_done(done_file, result)
+            writer.checkError()
+        else:
+            for idx, file in enumerate(files):
+                result = generate_model(str(file), config, idx=idx, total=len(files))
+                on_model_done(str(file), result)
+        manifest.commit()
+        if shard_packer is not None:
+            shard_packer.close()
+        if shard_writer is not None:
+            shard_writer.close()
+        if run_log is not None:
+            run_log.close()
+            print(f"\n[Generator] Stage timings and counters saved in {run_log.jsonl_name} and {run_log.csv_name}")
     else:
         print("Reading features list...")
+        features_files = list_files(features_folder_dir, FEATURES_FORMATS, return_str=True)
+        features_files = [f[(f.rfind('/') + 1):f.rindex('.')] for f in features_files]
+        statistics_files = list_files(stats_folder_dir, STATS_FORMATS, return_str=True)
+        statistics_files = [f[(f.rfind('/') + 1):f.rindex('.')] for f in statistics_files]
         features = list(set(features_files) - set(statistics_files)) if not delete_old_data else \
                                                                     features_files
-        for idx, feature_name in enumerate(features):
-            print(f"\nProcessing file - Model {feature_name} - [{idx+1}/{len(features)}]:")
-
-            stats_name = os.path.join(stats_folder_dir, feature_name)
-            remove_by_filename(stats_name, STATS_FORMATS)
-
-            mesh_p = Path(os.path.join(mesh_folder_dir, feature_name))
-
-            mesh = loadMeshPLY(mesh_p)
-
-            features_path = os.path.join(features_folder_dir, feature_name)
-            features_data = loadFeatures(features_path, features_file_type)
-
-            geometries = {'curves': [], 'surfaces': []}
-            for curve_data in features_data['curves']:
-                curve = CurveFactory.fromDict(curve_data)
-                curve.setMeshByGlobal(mesh)
-                geometries['curves'].append({'geometry': curve})
-            for surface_data in features_data['surfaces']:
-                surface = SurfaceFactory.fromDict(surface_data)
-                surface.setMeshByGlobal(mesh)
-                geometries['surfaces'].append({'geometry': surface})
-
-            print("\nGenerating statistics...")
-            stats = generateStatistics(geometries, mesh)
-
-            print("Writing stats in statistic file...")
-            writeJSON(stats_name, stats)
-
-            del mesh, features_data, stats
-            gc.collect()
+        stats_config = {
+            'mesh_folder_dir': mesh_folder_dir,
+            'features_folder_dir': features_folder_dir,
+            'features_file_type': features_file_type,
+            'stats_folder_dir': stats_folder_dir,
+        }
+        tasks = [(feature_name, stats_config) for feature_name in features]
+        if workers > 1:
+            pool = multiprocessing.Pool(processes=workers)
+            results = pool.imap_unordered(compute_model_stats, tasks, chunksize=16)
+        else:
+            pool = None
+            results = map(compute_model_stats, tasks)
+        try:
+            for feature_name, stats in tqdm(results, total=len(tasks), desc='[Statistics]'):
+                manifest.setStats(feature_name, stats)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
         print(f"\nDone. {len(features)} were processed.")
+    manifest.close()
+
+    if dataset_stats:
+        stats_files = list_files(stats_folder_dir, STATS_FORMATS, return_str=True)
+        updateDatasetStatistics(stats_files, output_path, workers=workers)
+        print("\n[Dataset statistics] Done.")
     # <--- Main loop
 
 if __name__ == '__main__':
@@ -2,4 +2,15 @@ from .tools import *
 from .generate_gmsh import *
 from .generate_mesh_occ import *
 from .generate_pythonocc import *
-from .generate_statistics import *
\ No newline at end of file
+from .generate_statistics import *
+from .process_runner import *
+from .topology import *
+from .cache import *
+from .columnar import *
+from .shards import *
+from .manifest import *
+from .dataset_statistics import *
+from .submesh import *
+from .ply import *
+from .pipeline import *
+from .instrumentation import *
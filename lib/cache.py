@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+
+# Bump it whenever a change in the code modifies the generated outputs, so cached models are regenerated
+GENERATOR_VERSION = '1.1.0'
+
+def hashFile(filename, chunk_size=2**20) -> str:
+    """ Returns the sha256 of the content of a file """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def hashFileWithEntry(filename, entry=None):
+    """ Returns the file hash and a cache entry for it, the hash stored in entry is reused when
+    size and modification time of the file did not change """
+    stat = os.stat(filename)
+    if entry is not None and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns \
+       and 'input_hash' in entry:
+        input_hash = entry['input_hash']
+    else:
+        input_hash = hashFile(filename)
+    return input_hash, {'input_hash': input_hash, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def computeModelKey(input_hash: str, parameters: dict) -> str:
+    """ Returns the cache key of a model given the hash of its input and the output-affecting parameters """
+    content = json.dumps({'input_hash': input_hash, 'parameters': parameters, 'version': GENERATOR_VERSION},
+                         sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def getCachedFile(cache_dir: str, key: str, extension: str):
+    """ Returns the path of a cached file, or None. A hit refreshes its modification time, used as LRU clock """
+    filename = os.path.join(cache_dir, key + extension)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        os.utime(filename)
+    except OSError:
+        return None
+    return filename
+
+def evictCache(cache_dir: str, max_size: int):
+    """ Removes the least recently used files until the cache directory uses at most max_size bytes """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError: # removed by another worker
+            pass
+        total_size -= size
+
+def putCachedFile(cache_dir: str, key: str, extension: str, write_function, max_size: int):
+    """ Stores a file in the cache using write_function(filename) and evicts the least recently used ones.
+        max_size is in bytes, 0 means no limit """
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.join(cache_dir, key + extension)
+    # unique temporary name, other workers may be writing the same key
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    try:
+        write_function(tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    if max_size > 0:
+        evictCache(cache_dir, max_size)
+    return filename
@@ -0,0 +1,209 @@
+import json
+import struct
+import zipfile
+import numpy as np
+
+# Columnar features layout (.npz, stored uncompressed so every member can be memory mapped).
+# For each group (curves, surfaces) and each feature key there is a column with the arrays:
+#   <group>/<key>/presence  bool (n,), entity has the key
+#   <group>/<key>/none      bool (n,), value is None (only when some value is None)
+#   <group>/<key>/values    values of the remaining entities, concatenated along the first axis for lists
+#   <group>/<key>/offsets   int64 (m + 1,), range of each entity in values (only for lists)
+# and 'schema' holds, as json, the number of entities and the kind of each column.
+
+COLUMN_SCALAR = 'scalar'
+COLUMN_STRING = 'string'
+COLUMN_ARRAY = 'array'
+COLUMN_JSON = 'json'
+COLUMN_NONE = 'none'
+
+NUMERIC_KINDS = 'biuf'
+
+# the only columns stored as float32 and int32 (when the values fit) with compact, the geometry definitions
+# (locations, axes, poles, knots, weights...) always keep float64
+COMPACT_FLOAT_KEYS = ['vert_parameters']
+COMPACT_INDEX_KEYS = ['vert_indices', 'face_indices']
+
+def isScalar(value):
+    return isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating))
+
+def encodeArrays(values, compact_floats=False, compact_ints=False):
+    """ Concatenates the values in a flat array with offsets, None when they are not homogeneous numeric arrays """
+    try:
+        arrays = [np.asarray(value) for value in values]
+    except ValueError: # ragged nested lists
+        return None
+    tail = None
+    for array in arrays:
+        if array.dtype.kind not in NUMERIC_KINDS or array.ndim == 0:
+            if array.size > 0 or array.ndim == 0:
+                return None
+        if array.size > 0:
+            if tail is None:
+                tail = array.shape[1:]
+            elif array.shape[1:] != tail:
+                return None
+    tail = () if tail is None else tail
+    non_empty = [array for array in arrays if array.size > 0]
+    dtype = np.result_type(*non_empty) if len(non_empty) > 0 else np.dtype(np.float64)
+    if dtype.kind == 'f':
+        dtype = np.float32 if compact_floats else np.float64
+    elif dtype.kind in 'iu':
+        dtype = np.int64
+        int32 = np.iinfo(np.int32)
+        if compact_ints and all(array.min() >= int32.min and array.max() <= int32.max for array in non_empty):
+            dtype = np.int32
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(array) for array in arrays])
+    if len(non_empty) > 0:
+        flat = np.concatenate([array.astype(dtype, copy=False) for array in non_empty], axis=0)
+    else:
+        flat = np.zeros((0,) + tail, dtype=dtype)
+    return flat, offsets
+
+def encodeColumn(values, compact_floats=False, compact_ints=False):
+    """ Returns the kind and the arrays of a column given the (not None) values of the entities """
+    if all(isinstance(value, str) for value in values):
+        return COLUMN_STRING, {'values': np.array(values, dtype=str)}
+    booleans = [isinstance(value, (bool, np.bool_)) for value in values]
+    if all(isScalar(value) for value in values) and (all(booleans) or not any(booleans)):
+        return COLUMN_SCALAR, {'values': np.array(values)}
+    if all(isinstance(value, (list, tuple, np.ndarray)) for value in values):
+        encoded = encodeArrays(values, compact_floats=compact_floats, compact_ints=compact_ints)
+        if encoded is not None:
+            return COLUMN_ARRAY, {'values': encoded[0], 'offsets': encoded[1]}
+    values = [value.tolist() if isinstance(value, np.ndarray) else value for value in values]
+    return COLUMN_JSON, {'values': np.array([json.dumps(value) for value in values], dtype=str)}
+
+def bufferValue(value):
+    """ Numeric lists are buffered as arrays, which take much less memory than lists of python numbers """
+    if isinstance(value, (list, tuple)):
+        try:
+            array = np.asarray(value)
+        except ValueError: # ragged nested lists
+            return value
+        if array.dtype.kind in NUMERIC_KINDS and array.ndim > 0:
+            return array
+    return value
+
+class ColumnarBuilder:
+    """ Builds the columnar arrays of features added one entity at a time. The values of each column are
+        appended to its buffers as they come, so the feature dicts do not have to be kept until the end """
+    def __init__(self, groups, compact=False):
+        self.compact = compact
+        self.counts = {group: 0 for group in groups}
+        self.columns = {group: {} for group in groups}
+
+    def add(self, group: str, entity: dict):
+        index = self.counts[group]
+        self.counts[group] += 1
+        for key, value in entity.items():
+            column = self.columns[group].setdefault(key, {'presence': [], 'none': [], 'values': []})
+            column['presence'].append(index)
+            if value is None:
+                column['none'].append(index)
+            else:
+                column['values'].append(bufferValue(value))
+
+    def arrays(self) -> dict:
+        """ Encodes the buffered columns, releasing each buffer once it is encoded """
+        arrays = {}
+        schema = {}
+        for group, columns in self.columns.items():
+            schema[group] = {'count': self.counts[group], 'columns': {}}
+            for key in list(columns.keys()):
+                column = columns.pop(key)
+                presence = np.zeros(self.counts[group], dtype=bool)
+                presence[column['presence']] = True
+                prefix = f'{group}/{key}/'
+                arrays[prefix + 'presence'] = presence
+                if len(column['none']) > 0:
+                    none = np.zeros(self.counts[group], dtype=bool)
+                    none[column['none']] = True
+                    arrays[prefix + 'none'] = none
+                if len(column['values']) == 0:
+                    kind = COLUMN_NONE
+                else:
+                    kind, encoded = encodeColumn(column['values'],
+                                                 compact_floats=(self.compact and key in COMPACT_FLOAT_KEYS),
+                                                 compact_ints=(self.compact and key in COMPACT_INDEX_KEYS))
+                    for name, array in encoded.items():
+                        arrays[prefix + name] = array
+                schema[group]['columns'][key] = kind
+        arrays['schema'] = np.array(json.dumps(schema))
+        return arrays
+
+def encodeFeatures(features: dict, compact=False) -> dict:
+    """ Converts a features dict ({'curves': [...], 'surfaces': [...]}) to columnar arrays. With compact
+        the mesh parameters are stored as float32 and the mesh indices as int32 (when the values fit) """
+    builder = ColumnarBuilder(features.keys(), compact=compact)
+    for group, entities in features.items():
+        for entity in entities:
+            builder.add(group, entity)
+    return builder.arrays()
+
+def decodeFeatures(arrays) -> dict:
+    """ Converts columnar arrays back to the features dict, with python lists as loaded from json """
+    schema = json.loads(str(arrays['schema']))
+    features = {}
+    for group, group_schema in schema.items():
+        entities = [{} for _ in range(group_schema['count'])]
+        for key, kind in group_schema['columns'].items():
+            prefix = f'{group}/{key}/'
+            presence = np.asarray(arrays[prefix + 'presence'])
+            none = np.asarray(arrays[prefix + 'none']) if (prefix + 'none') in arrays else np.zeros_like(presence)
+            valid = presence & ~none
+            value_index = np.cumsum(valid) - 1
+            if kind == COLUMN_ARRAY:
+                values = arrays[prefix + 'values']
+                offsets = np.asarray(arrays[prefix + 'offsets'])
+                get = lambda j: values[offsets[j]:offsets[j + 1]].tolist()
+            elif kind == COLUMN_JSON:
+                values = arrays[prefix + 'values'].tolist()
+                get = lambda j: json.loads(values[j])
+            elif kind != COLUMN_NONE:
+                values = arrays[prefix + 'values'].tolist()
+                get = lambda j: values[j]
+            for i in np.flatnonzero(presence):
+                entities[i][key] = get(value_index[i]) if valid[i] else None
+        features[group] = entities
+    return features
+
+def writeColumnar(filename: str, features: dict, compact=False):
+    np.savez(filename, **encodeFeatures(features, compact=compact))
+
+def writeColumnarArrays(filename: str, arrays: dict):
+    np.savez(filename, **arrays)
+
+def loadColumnarArrays(filename: str, mmap=False) -> dict:
+    """ Loads the arrays of a .npz file. With mmap the (uncompressed) members are memory mapped instead of read """
+    if not mmap:
+        with np.load(filename, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            # local file header: 30 fixed bytes, then the file name and the extra field
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject or len(shape) == 0 or 0 in shape:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=f.tell(), shape=shape, \
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+def loadColumnar(filename: str, mmap=False) -> dict:
+    return decodeFeatures(loadColumnarArrays(filename, mmap=mmap))
@@ -0,0 +1,201 @@
+import os
+import json
+import multiprocessing
+import numpy as np
+
+# Dataset statistics are a map-reduce over the per-model statistics files. Every part of the aggregate
+# but the faces range is additive (totals, per type counts and fixed-bin histograms), and the state keeps
+# the contribution of each file, so new, modified and removed models are added to or subtracted from the
+# stored aggregate without reading the other models again.
+
+DATASET_STATS_STATE = 'dataset_stats_state.json'
+DATASET_STATS_REPORT = 'dataset_stats'
+
+# log10 bins, the first and last ones also hold what is out of the range
+FACES_BINS = np.linspace(0., 9., 9*20 + 1) # 20 bins per decade, up to 1e9 triangles
+AREA_BINS = np.linspace(-6., 12., 18*4 + 1) # 4 bins per decade, areas from 1e-6 to 1e12
+PERCENTILES = [50, 90, 95, 99]
+
+TOTAL_KEYS = ['number_vertices', 'number_faces', 'number_curves', 'number_surfaces', 'number_void_curves',
+              'number_void_surfaces']
+
+def emptyAggregate() -> dict:
+    aggregate = {'number_models': 0, 'area': 0., 'curves': {}, 'surfaces': {},
+                 'faces_histogram': [0]*(len(FACES_BINS) - 1), 'area_histogram': [0]*(len(AREA_BINS) - 1),
+                 'min_faces': None, 'max_faces': None}
+    for key in TOTAL_KEYS:
+        aggregate[key] = 0
+    return aggregate
+
+def histogramIndex(value, bins) -> int:
+    position = np.log10(value) if value > 0 else bins[0]
+    return int(np.clip(np.searchsorted(bins, position, side='right') - 1, 0, len(bins) - 2))
+
+def addTypes(target: dict, source: dict):
+    for tp, data in source.items():
+        if not isinstance(data, dict):
+            continue
+        entry = target.setdefault(tp, {'number_models': 0})
+        entry['number_models'] += data.get('number_models', 1)
+        for key, value in data.items():
+            if key != 'number_models':
+                entry[key] = entry.get(key, 0) + value
+
+def mapModelStats(stats: dict) -> dict:
+    """ Returns the aggregate of a single model """
+    aggregate = emptyAggregate()
+    aggregate['number_models'] = 1
+    for key in TOTAL_KEYS:
+        aggregate[key] = stats.get(key, 0)
+    area = stats.get('surfaces', {}).get('area', 0.)
+    aggregate['area'] = area
+    addTypes(aggregate['curves'], stats.get('curves', {}))
+    addTypes(aggregate['surfaces'], stats.get('surfaces', {}))
+    number_faces = stats.get('number_faces', 0)
+    aggregate['faces_histogram'][histogramIndex(number_faces, FACES_BINS)] += 1
+    aggregate['area_histogram'][histogramIndex(area, AREA_BINS)] += 1
+    aggregate['min_faces'] = number_faces
+    aggregate['max_faces'] = number_faces
+    return aggregate
+
+def modelContribution(stats: dict) -> dict:
+    """ Part of the statistics of a model used by the aggregate, kept in the state for each file """
+    contribution = {key: stats.get(key, 0) for key in TOTAL_KEYS}
+    contribution['curves'] = stats.get('curves', {})
+    contribution['surfaces'] = stats.get('surfaces', {})
+    return contribution
+
+def reduceAggregates(a: dict, b: dict) -> dict:
+    """ Merges the aggregate b into a """
+    for key in ['number_models', 'area'] + TOTAL_KEYS:
+        a[key] += b[key]
+    addTypes(a['curves'], b['curves'])
+    addTypes(a['surfaces'], b['surfaces'])
+    for key in ['faces_histogram', 'area_histogram']:
+        a[key] = [x + y for x, y in zip(a[key], b[key])]
+    for key, function in [('min_faces', min), ('max_faces', max)]:
+        values = [v for v in [a[key], b[key]] if v is not None]
+        a[key] = function(values) if len(values) > 0 else None
+    return a
+
+def subtractAggregates(a: dict, b: dict) -> dict:
+    """ Removes the aggregate b from a, the faces range has to be recomputed by the caller """
+    for key in ['number_models', 'area'] + TOTAL_KEYS:
+        a[key] -= b[key]
+    for group in ['curves', 'surfaces']:
+        for tp, data in b[group].items():
+            entry = a[group].get(tp)
+            if entry is None:
+                continue
+            for key, value in data.items():
+                entry[key] = entry.get(key, 0) - value
+            if entry['number_models'] <= 0:
+                del a[group][tp]
+    for key in ['faces_histogram', 'area_histogram']:
+        a[key] = [x - y for x, y in zip(a[key], b[key])]
+    return a
+
+def mapStatsFiles(filenames: list) -> dict:
+    """ Map step of a chunk of statistics files, the contribution of each file that could be read """
+    contributions = {}
+    for filename in filenames:
+        try:
+            with open(filename, 'r') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            continue
+        contributions[filename] = modelContribution(stats)
+    return contributions
+
+def readStatsFiles(filenames: list, workers=1, chunk_size=256) -> dict:
+    chunks = [filenames[i:(i + chunk_size)] for i in range(0, len(filenames), chunk_size)]
+    contributions = {}
+    if workers > 1 and len(chunks) > 1:
+        with multiprocessing.Pool(processes=workers) as pool:
+            for partial in pool.imap_unordered(mapStatsFiles, chunks):
+                contributions.update(partial)
+    else:
+        for chunk in chunks:
+            contributions.update(mapStatsFiles(chunk))
+    return contributions
+
+def aggregateStatsFiles(filenames: list, workers=1, chunk_size=256) -> dict:
+    aggregate = emptyAggregate()
+    for contribution in readStatsFiles(filenames, workers=workers, chunk_size=chunk_size).values():
+        reduceAggregates(aggregate, mapModelStats(contribution))
+    return aggregate
+
+def histogramPercentiles(histogram: list, bins, percentiles=PERCENTILES) -> dict:
+    """ Returns the percentiles of a log10 histogram, as the upper edge of the bin where they fall """
+    counts = np.asarray(histogram, dtype=np.int64)
+    if counts.sum() == 0:
+        return {f'p{p}': None for p in percentiles}
+    cumulative = np.cumsum(counts)
+    result = {}
+    for p in percentiles:
+        index = int(np.searchsorted(cumulative, p/100.*cumulative[-1], side='left'))
+        result[f'p{p}'] = float(10**bins[index + 1])
+    return result
+
+def generateDatasetReport(aggregate: dict) -> dict:
+    rate = lambda part, total: part/total if total > 0 else 0.
+    report = {key: aggregate[key] for key in ['number_models'] + TOTAL_KEYS + ['area']}
+    report['void_curves_rate'] = rate(aggregate['number_void_curves'], aggregate['number_curves'])
+    report['void_surfaces_rate'] = rate(aggregate['number_void_surfaces'], aggregate['number_surfaces'])
+    report['curves'] = {}
+    for tp, data in sorted(aggregate['curves'].items(), key=lambda item: -item[1].get('number_curves', 0)):
+        report['curves'][tp] = dict(data)
+        report['curves'][tp]['void_rate'] = rate(data.get('number_void_curves', 0), data.get('number_curves', 0))
+    report['surfaces'] = {}
+    for tp, data in sorted(aggregate['surfaces'].items(), key=lambda item: -item[1].get('number_surfaces', 0)):
+        report['surfaces'][tp] = dict(data)
+        report['surfaces'][tp]['void_rate'] = rate(data.get('number_void_surfaces', 0), data.get('number_surfaces', 0))
+        report['surfaces'][tp]['area_fraction'] = rate(data.get('area', 0.), aggregate['area'])
+    report['faces'] = {'min': aggregate['min_faces'], 'max': aggregate['max_faces'],
+                       'mean': rate(aggregate['number_faces'], aggregate['number_models'])}
+    report['faces'].update(histogramPercentiles(aggregate['faces_histogram'], FACES_BINS))
+    report['area_histogram'] = {'log10_bins': AREA_BINS.tolist(), 'counts': aggregate['area_histogram']}
+    return report
+
+def statsSignature(filename: str) -> list:
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def updateDatasetStatistics(stats_files: list, output_path: str, workers=1) -> dict:
+    """ Updates the dataset aggregate stored in output_path with the statistics files and writes the report.
+        Only new and modified files are read, removed files are subtracted with their stored contribution """
+    state_name = os.path.join(output_path, DATASET_STATS_STATE)
+    state = {'files': {}, 'aggregate': emptyAggregate()}
+    if os.path.isfile(state_name):
+        with open(state_name, 'r') as f:
+            state = json.load(f)
+
+    signatures = {str(filename): statsSignature(filename) for filename in stats_files}
+    files = state['files']
+    aggregate = state['aggregate']
+    removed = [name for name in files.keys() if name not in signatures or signatures[name] != files[name]['signature']]
+    new_files = [name for name in signatures.keys() if name not in files or name in removed]
+    number_removed = sum(1 for name in removed if name not in signatures)
+    print(f'\n[Dataset statistics] Aggregating {len(new_files)} new or modified and removing {number_removed} ' \
+          f'of {len(signatures)} models...')
+
+    for name in removed:
+        subtractAggregates(aggregate, mapModelStats(files.pop(name)['contribution']))
+    for name, contribution in readStatsFiles(new_files, workers=workers).items():
+        files[name] = {'signature': signatures[name], 'contribution': contribution}
+        reduceAggregates(aggregate, mapModelStats(contribution))
+    if len(removed) > 0:
+        # the range is not additive, it is taken again from the contributions of the remaining files
+        number_faces = [data['contribution']['number_faces'] for data in files.values()]
+        aggregate['min_faces'] = min(number_faces) if len(number_faces) > 0 else None
+        aggregate['max_faces'] = max(number_faces) if len(number_faces) > 0 else None
+
+    # writing to a temporary file first, an interrupted run must not corrupt the state
+    with open(state_name + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_name + '.tmp', state_name)
+
+    report = generateDatasetReport(aggregate)
+    with open(os.path.join(output_path, DATASET_STATS_REPORT + '.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
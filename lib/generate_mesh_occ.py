@@ -6,12 +6,19 @@ from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
 from OCC.Core.IMeshTools import IMeshTools_Parameters
 from OCC.Core.GeomAbs import GeomAbs_CurveType
 from OCC.Core.BRepAdaptor import BRepAdaptor_Curve
-from OCC.Core.BRepTools import breptools_Compare
+from OCC.Core.BRepTools import breptools_Compare, breptools_Clean
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopAbs import TopAbs_FACE
+from OCC.Core.TopoDS import topods
 from OCC.Core.gp import gp_Pnt, gp_Pnt2d
 import OCC.Core.ShapeFix as ShapeFix
 from OCC.Core.ShapeAnalysis import ShapeAnalysis_Surface
 from asGeometryOCCWrapper.surfaces import SurfaceFactory
 
+from lib.topology import getEdgeVertices, getFaceEdges
+from lib.instrumentation import count
+from lib.process_runner import forkMap
+
 from tqdm import tqdm
 
 MAX_INT = 2**31 - 1
@@ -27,7 +34,7 @@ MAX_INT = 2**31 - 1
 #                 break
 #     return index, hc
 
-def paramsMerge(a, b):
+def paramsMergeSequential(a, b):
     i = 0
     j = 0
     k = 0
@@ -68,104 +75,236 @@ def paramsMerge(a, b):
 
     return merge_list[:k], a_map, b_map
 
-def searchEntityInMap(entity, map, use_issame=True):
-    hc = entity.HashCode(MAX_INT)
-    index = -1
-    if hc in map:
-        for qindex, qentity in map[hc]:
-            if use_issame:
-                if entity.IsSame(qentity):
-                    index = qindex
-                    break
-            else:
-                if entity.IsEqual(qentity):
-                    index = qindex
-                    break
-    return index
-
-def addEntityToMap(index, entity, map):
-    hc = entity.HashCode(MAX_INT)
-    if hc in map:
-        map[hc].append((index, entity))
-    else:
-        map[hc] = [(index, entity)]
+def paramsMerge(a, b, atol=1e-8):
+    """ Merges two ascending lists of edge parameters, collapsing the pairs closer than atol.
+        Returns the merged parameters and the maps from a and b indices to merged indices """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if np.any(np.diff(a) < 0) or np.any(np.diff(b) < 0):
+        return paramsMergeSequential(a, b)
+
+    # first b parameter that is not smaller than a - atol, it is a match if it is close to a
+    candidates = np.searchsorted(b, a - atol, side='left')
+    valid = candidates < len(b)
+    matched = np.zeros(len(a), dtype=bool)
+    matched[valid] = b[candidates[valid]] <= (a[valid] + atol)
+
+    # each b parameter can be matched just once, with the first a parameter
+    matched_a = np.flatnonzero(matched)
+    matched_b, first_occurrence = np.unique(candidates[matched_a], return_index=True)
+    matched_a = matched_a[first_occurrence]
+
+    unmatched_b = np.ones(len(b), dtype=bool)
+    unmatched_b[matched_b] = False
+    unmatched_b = np.flatnonzero(unmatched_b)
+
+    values = np.concatenate([a, b[unmatched_b]])
+    order = np.argsort(values, kind='stable')
+    positions = np.empty(len(values), dtype=np.int32)
+    positions[order] = np.arange(len(values), dtype=np.int32)
+
+    a_map = positions[:len(a)]
+    b_map = np.zeros(len(b), dtype=np.int32) - 1
+    b_map[matched_b] = a_map[matched_a]
+    b_map[unmatched_b] = positions[len(a):]
+
+    return values[order], a_map, b_map
+
+def meshDtypes(compact=False):
+    """ Returns the vertex and index dtypes of the global mesh, float32 and int32 when compact """
+    return (np.float32, np.int32) if compact else (np.float64, np.int64)
+
+def packMeshData(mesh_data: dict, compact=False) -> dict:
+    """ Returns the mesh data with lists, or with int32 and float32 arrays when compact. Compact arrays are
+        turned into lists only when the geometry is bound (see SubmeshView.bind) """
+    _, index_dtype = meshDtypes(compact)
+    packed = {}
+    for key, values in mesh_data.items():
+        if compact:
+            packed[key] = np.asarray(values, dtype=np.float32 if key == 'vert_parameters' else index_dtype)
+        else:
+            packed[key] = values.tolist() if isinstance(values, np.ndarray) else values
+    return packed
+
+class ArrayBuffer:
+    """ Growable array of fixed-width rows, with amortized (doubling) reallocation """
+    def __init__(self, width, dtype, capacity=1024):
+        self.data = np.empty((capacity, width), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.data[:self.size][index]
+
+    def extend(self, rows):
+        """ Appends the rows and returns the index of the first one """
+        first = self.size
+        new_size = self.size + len(rows)
+        if new_size > len(self.data):
+            new_data = np.empty((max(new_size, 2*len(self.data)), self.data.shape[1]), dtype=self.data.dtype)
+            new_data[:self.size] = self.data[:self.size]
+            self.data = new_data
+        self.data[first:new_size] = rows
+        self.size = new_size
+        return first
+
+    def toArray(self):
+        """ Returns the used rows, releasing the spare capacity without copying """
+        self.data.resize((self.size, self.data.shape[1]), refcheck=False)
+        return self.data
+
+def getTriangulationNodes(triangulation):
+    """ Returns all the nodes of a Poly_Triangulation as a (NbNodes, 3) array in its local coordinates """
+    number_vertices = triangulation.NbNodes()
+    nodes = np.fromiter((c for i in range(1, number_vertices + 1) for c in triangulation.Node(i).Coord()),
+                        dtype=np.float64, count=3*number_vertices)
+    return nodes.reshape(number_vertices, 3)
+
+def getTriangulationUVNodes(triangulation):
+    """ Returns all the UV nodes of a Poly_Triangulation as a (NbNodes, 2) array """
+    number_vertices = triangulation.NbNodes()
+    if not triangulation.HasUVNodes():
+        return np.zeros((number_vertices, 2), dtype=np.float64)
+    uv_nodes = np.fromiter((c for i in range(1, number_vertices + 1) for c in triangulation.UVNode(i).Coord()),
+                           dtype=np.float64, count=2*number_vertices)
+    return uv_nodes.reshape(number_vertices, 2)
+
+def getTriangulationTriangles(triangulation):
+    """ Returns all the triangles of a Poly_Triangulation as a (NbTriangles, 3) array of 0-based node indices """
+    number_faces = triangulation.NbTriangles()
+    triangles = np.fromiter((i for t in range(1, number_faces + 1) for i in triangulation.Triangle(t).Get()),
+                            dtype=np.int64, count=3*number_faces)
+    return triangles.reshape(number_faces, 3) - 1
+
+def getTransformMatrix(transform):
+    """ Returns the 3x4 matrix of a gp_Trsf, scale factor included """
+    return np.array([[transform.Value(r, c) for c in range(1, 5)] for r in range(1, 4)])
+
+def transformPoints(points, matrix):
+    """ Applies a 3x4 transformation matrix to a (N, 3) array with a single matrix multiply """
+    return points @ matrix[:, :3].T + matrix[:, 3]
+
+def addNewMeshVertices(local_indices, face_vert_global_map, face_vert_local_map, face_nodes, mesh_vertices):
+    """ Gives global ids, in order of first appearance, to the not yet mapped nodes of local_indices
+        that are not remapped to another local node """
+    new_mask = np.logical_and(face_vert_global_map[local_indices] == -1,
+                              face_vert_local_map[local_indices] == local_indices)
+    new_indices = local_indices[new_mask]
+    _, first_occurrence = np.unique(new_indices, return_index=True)
+    new_indices = new_indices[np.sort(first_occurrence)]
+
+    face_vert_global_map[new_indices] = np.arange(len(mesh_vertices), len(mesh_vertices) + len(new_indices))
+    mesh_vertices.extend(face_nodes[new_indices])
+
+def extractFaceData(face, edges, vertices, topology_index, face_index):
+    """ Phase one of computeMeshData: reads the triangulation, UV nodes and edge polygons of a face
+        using only face-local indices. Returns None if the face has no triangulation """
+    brep_tool = BRep_Tool()
+    location = TopLoc_Location()
+    triangulation = brep_tool.Triangulation(face, location, 0)
+
+    if triangulation is None:
+        return None
+
+    transform = location.Transformation()
+    inverse_transform = transform.Inverted()
+
+    #looking to all edges that bound the current face
+    edges_data = []
+    for edge_index in getFaceEdges(topology_index, face_index):
+        edge = edges[edge_index] #TopoDS_Edge object
+
+        vertices_index = getEdgeVertices(topology_index, edge_index)
+        vertices_params = np.array([brep_tool.Parameter(vertices[vertex_index], edge, face) 
+                                    for vertex_index in vertices_index])
+        vertices_array = np.asarray([brep_tool.Pnt(vertices[vertex_index]).Transformed(inverse_transform).Coord() 
+                                    for vertex_index in vertices_index])
+
+        edge_vert_local = None
+        edge_param_local = None
+        polygon = brep_tool.PolygonOnTriangulation(edge, triangulation, location) # projecting edge in the face triangulation
+        if polygon is not None:
+            edge_vert_local = np.asarray(polygon.Nodes(), dtype=np.int64) - 1 # map from mesh edge indices to face mesh indices
+            edge_param_local = np.asarray(polygon.Parameters())
+
+        edges_data.append({
+            'ei': edge_index,
+            'vi': vertices_index,
+            'vp': vertices_params,
+            'va': vertices_array,
+            'evl': edge_vert_local,
+            'epl': edge_param_local,
+        })
+
+    return {
+        'orientation': int(face.Orientation()),
+        'local_nodes': getTriangulationNodes(triangulation),
+        'uv_nodes': getTriangulationUVNodes(triangulation),
+        'triangles': getTriangulationTriangles(triangulation),
+        'transform': getTransformMatrix(transform),
+        'edges': edges_data,
+    }
+
+def extractFaceDataByIndex(face_extraction_input, face_index):
+    faces, edges, vertices, topology_index = face_extraction_input
+    return extractFaceData(faces[face_index], edges, vertices, topology_index, face_index)
+
+def extractFacesData(faces, edges, vertices, topology_index, workers=1):
+    """ Yields the phase one data of every face, in order, reading them in parallel when workers > 1 """
+    chunksize = max(1, min(64, len(faces)//(4*max(workers, 1))))
+    return forkMap(extractFaceDataByIndex, (faces, edges, vertices, topology_index), len(faces), workers=workers, \
+                   chunksize=chunksize)
 
 #TODO:remove unreferenced vertices per surface or curve
-def computeMeshData(vertices, edges, faces, topology):
-    vertices_mesh_data = []
-    vertices_map = {}
-    print('\n[PythonOCC] Mapping Vertices...')
-    for i, vertex in enumerate(tqdm(vertices)):
-        vertices_mesh_data.append(-1)
-        addEntityToMap(i, vertex, vertices_map)
-    vertices_mesh_data = np.asarray(vertices_mesh_data)
-
-    edges_mesh_data = []
-    edge_vertices_map = []
-    edges_map = {}
-    print('\n[PythonOCC] Mapping Edges...')
-    for i, edge in enumerate(tqdm(edges)):
-        edges_mesh_data.append({'vert_indices': [], 'vert_parameters': []})
-        addEntityToMap(i, edge, edges_map)
-        vertices_indices = [searchEntityInMap(vertex, vertices_map) for vertex in topology.vertices_from_edge(edge)]
-        edge_vertices_map.append(vertices_indices)
-
-    faces_mesh_data = []
-    face_edges_map = []
-    faces_map = {}
-    print('\n[PythonOCC] Mapping Faces...')
-    for i, face in enumerate(tqdm(faces)):
-        faces_mesh_data.append({'vert_indices': [], 'vert_parameters': [], 'face_indices': []})
-        addEntityToMap(i, face, faces_map)
-        edges_indices = [searchEntityInMap(edge, edges_map) for edge in topology.edges_from_face(face)]
-        face_edges_map.append(edges_indices)
-    mesh_vertices = []
-    mesh_faces = []
+def computeMeshData(vertices, edges, faces, topology_index, workers=1, compact=False):
+    """ Maps the face triangulations to a global mesh in two phases: the per-face reading (parallel
+        when workers > 1) and the sequential stitching that gives global ids along shared edges.
+        When compact the mesh and the mesh data use float32 and int32 """
+    vertices_mesh_data = np.zeros(len(vertices), dtype=np.int64) - 1
+    edges_mesh_data = [{'vert_indices': [], 'vert_parameters': []} for _ in edges]
+    faces_mesh_data = [{'vert_indices': [], 'vert_parameters': [], 'face_indices': []} for _ in faces]
+
+    vertex_dtype, index_dtype = meshDtypes(compact)
+    mesh_vertices = ArrayBuffer(3, vertex_dtype)
+    mesh_faces = ArrayBuffer(3, index_dtype)
     print('\n[PythonOCC] Generating Mesh Data...')
-    for face_index, face in enumerate(tqdm(faces)):
+    faces_data = extractFacesData(faces, edges, vertices, topology_index, workers=workers)
+    for face_index, face_data in enumerate(tqdm(faces_data, total=len(faces))):
         #print('----------------------------------------------------')
         #print("FACE_INDEX: ", face_index)
 
-        face_orientation = face.Orientation()
-
-        brep_tool = BRep_Tool()
-        location = TopLoc_Location()
-        triangulation = brep_tool.Triangulation(face, location, 0)
-        transform = location.Transformation()
-
-        if triangulation is None:
+        if face_data is None:
             #WARNING
+            count('faces_without_triangulation')
             continue
 
-        number_vertices = triangulation.NbNodes()
+        face_orientation = face_data['orientation']
+        face_local_nodes = face_data['local_nodes']
+        face_nodes = transformPoints(face_local_nodes, face_data['transform']) # global coordinates
+        face_uv_nodes = face_data['uv_nodes']
+        number_vertices = len(face_local_nodes)
 
         face_vert_global_map = np.zeros(number_vertices, dtype=np.int64) - 1 # map local face mesh id to global mesh id
-        face_vert_params = []
         face_vert_local_map = np.arange(number_vertices, dtype=np.int64) # map ids to another local ids (useful in deal with repeated vertices)
         face_vertex_node_map = np.zeros(number_vertices, dtype=np.int64) - 1
 
-        #looking to all edges that bound the current face
-        edges_index = face_edges_map[face_index]
         has_degenerated_edge = False
         edges_data = []
 
-        for edge_index in edges_index:            
-            edge = edges[edge_index] #TopoDS_Edge object
-
-            vertices_index = edge_vertices_map[edge_index]
-            vertices_params = np.array([brep_tool.Parameter(vertices[vertex_index], edge, face) 
-                                        for vertex_index in vertices_index])
-            vertices_array = np.asarray([brep_tool.Pnt(vertices[vertex_index]).Transformed(transform.Inverted()).Coord() 
-                                        for vertex_index in vertices_index])
+        for ed in face_data['edges']:
+            edge_index = ed['ei']
+            vertices_index = ed['vi']
+            vertices_params = ed['vp']
+            vertices_array = ed['va']
+            edge_vert_local = ed['evl']
+            edge_param_local = ed['epl']
 
-            polygon = brep_tool.PolygonOnTriangulation(edge, triangulation, location) # projecting edge in the face triangulation
-            if polygon is None:
+            if edge_vert_local is None:
                 #WARNING
                 continue
 
-            edge_vert_local = np.asarray(polygon.Nodes(), dtype=np.int64) - 1 # map from mesh edge indices to face mesh indices
-            edge_param_local = np.asarray(polygon.Parameters())
-
             edge_vert_local_unique = np.unique(edge_vert_local)
             if (len(edge_vert_local) -  len(edge_vert_local_unique)) > 1:
                 has_degenerated_edge = True
@@ -200,8 +339,7 @@ def computeMeshData(vertices, edges, faces, topology):
             is_reversed = np.allclose(vertices_params, edge_param_local[indices[1]], rtol=0.)
 
             if is_foward and is_reversed:
-                nodes_array = np.asarray([triangulation.Node(int(evl - 1)).Transformed(transform.Inverted()).Coord()
-                                            for evl in edge_vert_local[[0, -1]]])
+                nodes_array = face_local_nodes[edge_vert_local[[0, -1]]]
                 
                 is_foward = np.allclose(vertices_array, nodes_array[indices[0]], rtol=0.)
                 is_reversed = np.allclose(vertices_array, nodes_array[indices[1]], rtol=0.)
@@ -223,7 +361,6 @@ def computeMeshData(vertices, edges, faces, topology):
                 face_vertex_node_map[vertex_nodes] = vertices_index
 
             ed = {
-                'e': edge,
                 'ei': edge_index,
                 'vi': vertices_index,
                 'vp': vertices_params,
@@ -238,10 +375,10 @@ def computeMeshData(vertices, edges, faces, topology):
             edges_data.append(ed)
 
         if has_degenerated_edge:
+            count('canceled_degenerate_faces')
             continue
 
         for ed in edges_data:
-            edge = ed['e']
             edge_index = ed['ei']
             vertices_index = ed['vi']
             vertices_params = ed['vp']
@@ -263,7 +400,7 @@ def computeMeshData(vertices, edges, faces, topology):
                 edge_vert_local[bound_indices[1]] = first_vertex
 
                 assert face_vert_local_map[last_vertex] == last_vertex or face_vert_local_map[last_vertex] == face_vert_local_map[first_vertex], \
-                        f'{vertices_array} \n {np.asarray([triangulation.Node(int(i + 1)).Coord() for i in edge_vert_local[[0,-1]]])}'
+                        f'{vertices_array} \n {face_local_nodes[edge_vert_local[[0,-1]]]}'
 
                 #face_vert_local_map[last_vertex] = face_vert_local_map[first_vertex]
                 face_vert_local_map[face_vert_local_map == last_vertex] = face_vert_local_map[first_vertex]
@@ -337,13 +474,7 @@ def computeMeshData(vertices, edges, faces, topology):
                 face_vert_global_map[edge_vert_local[edge_mask]] = edge_vert_global_map[edge_mask]
 
             # to deal with edges that have not been global mapped before
-            for i in (edge_vert_local + 1):
-                if face_vert_global_map[i - 1] == -1 and face_vert_local_map[i - 1] == (i - 1):
-                    pnt = triangulation.Node(int(i))
-                    pnt.Transform(transform)
-                    pnt_array = np.array(pnt.Coord())
-                    mesh_vertices.append(pnt_array)
-                    face_vert_global_map[i - 1] = len(mesh_vertices) - 1
+            addNewMeshVertices(edge_vert_local, face_vert_global_map, face_vert_local_map, face_nodes, mesh_vertices)
             
             mask_minus_one = face_vert_global_map == -1
 
@@ -360,53 +491,43 @@ def computeMeshData(vertices, edges, faces, topology):
                 edges_mesh_data[edge_index]['vert_indices'] = face_vert_global_map[edge_vert_local]
                 edges_mesh_data[edge_index]['vert_parameters'] = edge_param_local
 
-        for i in range(1, number_vertices + 1):
-            if face_vert_local_map[i - 1] == (i - 1):
-                if face_vert_global_map[i - 1] == -1:
-                    pnt = triangulation.Node(i)
-                    pnt.Transform(transform)
-                    pnt_array = np.array(pnt.Coord())
-                    mesh_vertices.append(pnt_array)
-                    face_vert_global_map[i - 1] = len(mesh_vertices) - 1
-
-                uv_node = triangulation.UVNode(i)
-                face_vert_params.append(list(uv_node.Coord()))
-
-        face_indices = []
-        number_faces = triangulation.NbTriangles()
-        for i in range(1, number_faces + 1):
-            i1, i2, i3 = triangulation.Triangle(i).Get()
-            i1_m = face_vert_global_map[i1 - 1]
-            i2_m = face_vert_global_map[i2 - 1]
-            i3_m = face_vert_global_map[i3 - 1]
-
-            if i1_m == i2_m or i1_m == i3_m or i2_m == i3_m:
-                if i1 == i2 or i1 == i3 or i2 == i3:
-                    #not a reamapping problem
-                    pass
-                else:
-                    #remapping warning: lets see if vertex coordinates have changed
-                    if not (np.allclose(mesh_vertices[i1_m], np.array(triangulation.Node(i1).Transformed(transform).Coord()), rtol=0.) and \
-                           np.allclose(mesh_vertices[i2_m], np.array(triangulation.Node(i2).Transformed(transform).Coord()), rtol=0.) and \
-                           np.allclose(mesh_vertices[i3_m], np.array(triangulation.Node(i3).Transformed(transform).Coord()), rtol=0.)):
-                        print(f'Vertices remapping problem.\n' \
-                              f'{mesh_vertices[i1_m]} != {np.array(triangulation.Node(i1).Transformed(transform).Coord())} or \n' \
-                              f'{mesh_vertices[i2_m]} != {np.array(triangulation.Node(i2).Transformed(transform).Coord())} or \n' \
-                              f'{mesh_vertices[i3_m]} != {np.array(triangulation.Node(i3).Transformed(transform).Coord())}')
-                
-            if face_orientation == 0:
-                verts_of_face = np.array([i1_m, i2_m, i3_m])
-                mesh_faces.append(verts_of_face)
-                face_indices.append(len(mesh_faces) - 1)
-            elif face_orientation == 1:
-                verts_of_face = np.array([i3_m, i2_m, i1_m])
-                mesh_faces.append(verts_of_face)
-                face_indices.append(len(mesh_faces) - 1)
+        # inner nodes of the face (and nodes not remapped to another local node)
+        local_indices = np.arange(number_vertices, dtype=np.int64)
+        addNewMeshVertices(local_indices, face_vert_global_map, face_vert_local_map, face_nodes, mesh_vertices)
+        face_vert_params = face_uv_nodes[face_vert_local_map == local_indices]
+
+        face_triangles = face_data['triangles']
+        face_triangles_global = face_vert_global_map[face_triangles]
+
+        global_degenerated = np.logical_or.reduce([face_triangles_global[:, 0] == face_triangles_global[:, 1],
+                                                   face_triangles_global[:, 0] == face_triangles_global[:, 2],
+                                                   face_triangles_global[:, 1] == face_triangles_global[:, 2]])
+        local_degenerated = np.logical_or.reduce([face_triangles[:, 0] == face_triangles[:, 1],
+                                                  face_triangles[:, 0] == face_triangles[:, 2],
+                                                  face_triangles[:, 1] == face_triangles[:, 2]])
+        #remapping warning: lets see if vertex coordinates have changed
+        remapped = np.logical_and(global_degenerated, ~local_degenerated)
+        if np.any(remapped):
+            global_coords = mesh_vertices[face_triangles_global[remapped]]
+            local_coords = face_nodes[face_triangles[remapped]].astype(vertex_dtype) # as stored in the global mesh
+            changed = ~np.all(np.isclose(global_coords, local_coords, rtol=0.), axis=(1, 2))
+            for global_coord, local_coord in zip(global_coords[changed], local_coords[changed]):
+                print(f'Vertices remapping problem.\n' \
+                      f'{global_coord[0]} != {local_coord[0]} or \n' \
+                      f'{global_coord[1]} != {local_coord[1]} or \n' \
+                      f'{global_coord[2]} != {local_coord[2]}')
+
+        if len(face_triangles_global) > 0:
+            if face_orientation == 1:
+                face_triangles_global = face_triangles_global[:, ::-1]
             else:
-                assert False, 'Face Orientation not Supported yet.'        
-      
-        faces_mesh_data[face_index] = {'vert_indices': face_vert_global_map.tolist(), 
-                                       'vert_parameters': face_vert_params, 'face_indices': face_indices}
+                assert face_orientation == 0, 'Face Orientation not Supported yet.'
+
+        first_face_index = mesh_faces.extend(face_triangles_global)
+        face_indices = np.arange(first_face_index, len(mesh_faces))
+
+        faces_mesh_data[face_index] = packMeshData({'vert_indices': face_vert_global_map, 'vert_parameters': face_vert_params,
+                                                    'face_indices': face_indices}, compact=compact)
 
     #unique_vert = np.arange(len(mesh_vertices))
     #unique_vert_faces = np.unique(np.asarray(mesh_faces))
@@ -418,25 +539,87 @@ def computeMeshData(vertices, edges, faces, topology):
     #print('locations:', len(locations))
 
     for edge_index in range(len(edges_mesh_data)):
-        if type(edges_mesh_data[edge_index]['vert_indices']) is not list:
-            edges_mesh_data[edge_index]['vert_indices'] = edges_mesh_data[edge_index]['vert_indices'].tolist()
-        if type(edges_mesh_data[edge_index]['vert_parameters']) is not list:
-            edges_mesh_data[edge_index]['vert_parameters'] = edges_mesh_data[edge_index]['vert_parameters'].tolist()
-                                    
-    return mesh_vertices, mesh_faces, edges_mesh_data, faces_mesh_data
+        edges_mesh_data[edge_index] = packMeshData(edges_mesh_data[edge_index], compact=compact)
 
-def OCCMeshGeneration(shape):
-    print('\n[PythonOCC] Mesh Generation...')
+    count('nodes', len(mesh_vertices))
+    count('triangles', len(mesh_faces))
+                                    
+    return mesh_vertices.toArray(), mesh_faces.toArray(), edges_mesh_data, faces_mesh_data
+
+#Ref: https://dev.opencascade.org/doc/refman/html/struct_i_mesh_tools___parameters.html#a3027dc569da3d3e3fcd76e0615befb27
+DEFAULT_MESH_PARAMETERS = {
+    'angle': 0.1,
+    'deflection': 0.01,
+    'min_size': 0.01,
+    'relative': True,
+    'in_parallel': True,
+}
+
+# parameters that do not change the resulting mesh, left out of the cache keys
+UNHASHED_MESH_PARAMETERS = ['in_parallel']
+
+# the triangle budget estimation meshes the shape with a deflection this times coarser
+BUDGET_COARSE_FACTOR = 16.
+
+def getMeshParameters(mesh_parameters=None) -> dict:
+    """ Returns DEFAULT_MESH_PARAMETERS updated by the given (possibly partial) parameters """
+    parameters = dict(DEFAULT_MESH_PARAMETERS)
+    if mesh_parameters is not None:
+        parameters.update({key: value for key, value in mesh_parameters.items() if value is not None})
+    return parameters
+
+def getHashedMeshParameters(mesh_parameters=None) -> dict:
+    """ Returns the mesh parameters that are part of the model and tessellation cache keys """
+    return {key: value for key, value in getMeshParameters(mesh_parameters).items() if key not in UNHASHED_MESH_PARAMETERS}
+
+def createIMeshToolsParameters(mesh_parameters: dict):
     parameters = IMeshTools_Parameters()
-
-    #Ref: https://dev.opencascade.org/doc/refman/html/struct_i_mesh_tools___parameters.html#a3027dc569da3d3e3fcd76e0615befb27
     parameters.MeshAlgo = -1
-    parameters.Angle = 0.1
-    parameters.Deflection = 0.01
-    parameters.MinSize = 0.01
-    parameters.Relative = True
-    parameters.InParallel = True
-
-    brep_mesh = BRepMesh_IncrementalMesh(shape, parameters)
+    parameters.Angle = mesh_parameters['angle']
+    parameters.Deflection = mesh_parameters['deflection']
+    parameters.MinSize = mesh_parameters['min_size']
+    parameters.Relative = mesh_parameters['relative']
+    parameters.InParallel = mesh_parameters['in_parallel']
+    return parameters
+
+def countTriangles(shape):
+    brep_tool = BRep_Tool()
+    number_triangles = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        location = TopLoc_Location()
+        triangulation = brep_tool.Triangulation(topods.Face(explorer.Current()), location, 0)
+        if triangulation is not None:
+            number_triangles += triangulation.NbTriangles()
+        explorer.Next()
+    return number_triangles
+
+def meshShape(shape, mesh_parameters: dict):
+    brep_mesh = BRepMesh_IncrementalMesh(shape, createIMeshToolsParameters(mesh_parameters))
     brep_mesh.Perform()
-    assert brep_mesh.IsDone()
\ No newline at end of file
+    assert brep_mesh.IsDone()
+
+def estimateBudgetDeflection(shape, mesh_parameters: dict, triangle_budget: int) -> float:
+    """ Estimates the deflection that gives about triangle_budget triangles, from a coarse mesh and
+        assuming the number of triangles is inversely proportional to the deflection. The returned
+        deflection is never finer than the configured one """
+    coarse_parameters = dict(mesh_parameters)
+    coarse_parameters['deflection'] = mesh_parameters['deflection']*BUDGET_COARSE_FACTOR
+    meshShape(shape, coarse_parameters)
+    coarse_triangles = countTriangles(shape)
+    breptools_Clean(shape)
+
+    if coarse_triangles == 0:
+        return mesh_parameters['deflection']
+    deflection = coarse_parameters['deflection']*coarse_triangles/triangle_budget
+    return max(deflection, mesh_parameters['deflection'])
+
+def OCCMeshGeneration(shape, mesh_parameters=None, triangle_budget=0):
+    print('\n[PythonOCC] Mesh Generation...')
+    mesh_parameters = getMeshParameters(mesh_parameters)
+
+    if triangle_budget > 0:
+        mesh_parameters['deflection'] = estimateBudgetDeflection(shape, mesh_parameters, triangle_budget)
+        print(f'\n[PythonOCC] Using deflection {mesh_parameters["deflection"]} for a budget of {triangle_budget} triangles')
+
+    meshShape(shape, mesh_parameters)
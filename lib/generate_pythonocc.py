@@ -1,3 +1,5 @@
+import os
+import tempfile
 from tqdm import tqdm
 import numpy as np
 
@@ -5,39 +7,42 @@ from OCC.Extend.DataExchange import read_step_file
 from OCC.Extend.TopologyUtils import TopologyExplorer
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
 from OCC.Core.gp import gp_Trsf
+from OCC.Core.TopTools import TopTools_IndexedMapOfShape
+from OCC.Core.TopExp import topexp
+from OCC.Core.TopAbs import TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE
+from OCC.Core.TopoDS import topods, TopoDS_Shape, TopoDS_Compound
+from OCC.Core.BRep import BRep_Builder
+from OCC.Core.BRepTools import breptools_Clean
+from OCC.Core.BinTools import bintools
 import OCC.Core.ShapeFix as ShapeFix
 
-from lib.generate_mesh_occ import OCCMeshGeneration, computeMeshData
+from lib.generate_mesh_occ import OCCMeshGeneration, computeMeshData, getHashedMeshParameters, meshDtypes, ArrayBuffer
+from lib.cache import hashFile, computeModelKey, getCachedFile, putCachedFile
+from lib.topology import buildTopologyIndex
+from lib.instrumentation import stage
+from lib.process_runner import forkMap
 from asGeometryOCCWrapper import CurveFactory, SurfaceFactory
 
-MAX_INT = 2**31 - 1
-
-def searchEntityByHashCode(entity, hash_code, dictionary):
-    search_code = 0 # 0: not_found; 1: not_found_but_hashcode_exists; 2: found
-    if hash_code in dictionary:
-        search_code = 1
-        entities_list = dictionary[hash_code]
-        for f in entities_list:
-            if entity.IsSame(f):
-                search_code = 2
-                break
-    return search_code
-
-def updateEntitiesDictBySearchCode(entity, hash_code, search_code, dictionary):
-    if search_code == 0:
-        dictionary[hash_code] = [entity]
-    elif search_code == 1:
-        dictionary[hash_code].append(entity) 
-    return dictionary
-
-def processEdgesAndFaces(vertices, edges, faces, topology, generate_mesh):
+def processEdgesAndFaces(vertices, edges, faces, generate_mesh, face_workers=1, compact=False):
     mesh = {}
     edges_mesh_data = [{} for _ in edges]
     faces_mesh_data = [{} for _ in faces]        
     if generate_mesh:
-        mesh['vertices'], mesh['faces'], edges_mesh_data, faces_mesh_data = computeMeshData(vertices, edges, faces, topology)
+        print('\n[PythonOCC] Indexing Topology...')
+        with stage('topology_index'):
+            topology_index = buildTopologyIndex(vertices, edges, faces)
+        with stage('mesh_mapping'):
+            mesh['vertices'], mesh['faces'], edges_mesh_data, faces_mesh_data = computeMeshData(vertices, edges, faces, topology_index, \
+                                                                                                  workers=face_workers, compact=compact)
 
-    geometries_data = {'curves': [], 'surfaces': []}
+    with stage('geometry_creation'):
+        geometries_data = createGeometries(edges, faces, edges_mesh_data, faces_mesh_data)
+
+    return geometries_data, mesh
+
+def createGeometries(edges, faces, edges_mesh_data, faces_mesh_data, geometries_data=None):
+    if geometries_data is None:
+        geometries_data = {'curves': [], 'surfaces': []}
     for i in range(len(edges)):
         geometry = CurveFactory.fromTopoDS(edges[i])
         if geometry is not None:
@@ -46,119 +51,256 @@ def processEdgesAndFaces(vertices, edges, faces, topology, generate_mesh):
         geometry = SurfaceFactory.fromTopoDS(faces[i])
         if geometry is not None:
             geometries_data['surfaces'].append({'geometry': geometry, 'mesh_data': faces_mesh_data[i]})
+    return geometries_data
 
-    return geometries_data, mesh
+def mapSubShapes(shapes, sub_type, sub_shapes_map):
+    for shape in shapes:
+        topexp.MapShapes(shape, sub_type, sub_shapes_map)
+    return sub_shapes_map
 
-# def addEdgesToDict(edges, edges_dict):
-#     for edge in edges:
-#         edge_hc = edge.HashCode(MAX_INT)
-#         search_code = searchEntityByHashCode(edge, edge_hc, edges_dict)
-#         if search_code == 2:
-#             continue
-#         else:
-#             edges_dict = updateEntitiesDictBySearchCode(edge, edge_hc, search_code, edges_dict)
-#     return edges_dict
-
-def addVerticesToDict(vertices, vertices_dict):
-    for vertex in vertices:
-        vertex_hc = vertex.HashCode(MAX_INT)
-        search_code = searchEntityByHashCode(vertex, vertex_hc, vertices_dict)
-        if search_code == 2:
-            continue
-        else:
-            vertices_dict = updateEntitiesDictBySearchCode(vertex, vertex_hc, search_code, vertices_dict)
-    return vertices_dict
-
-def addEdgesAndAssociatedVerticesToDict(edges, topology, edges_dict, vertices_dict):
-    for edge in edges:
-        edge_hc = edge.HashCode(MAX_INT)
-        search_code = searchEntityByHashCode(edge, edge_hc, edges_dict)
-        if search_code == 2:
-            continue
-        else:
-            vertices_dict = addVerticesToDict(topology.vertices_from_edge(edge), vertices_dict)
-            edges_dict = updateEntitiesDictBySearchCode(edge, edge_hc, search_code, edges_dict)
-   
-    return edges_dict, vertices_dict
-
-def addFacesAndAssociatedEdgesToDict(faces, topology, faces_dict, edges_dict, vertices_dict):
-    for face in faces:
-        face_hc = face.HashCode(MAX_INT)
-        search_code = searchEntityByHashCode(face, face_hc, faces_dict)
-        if search_code == 2:
-            continue
-        else:
-            edges_dict, vertices_dict = addEdgesAndAssociatedVerticesToDict(topology.edges_from_face(face), edges_dict)
-            faces_dict = updateEntitiesDictBySearchCode(face, face_hc, search_code, faces_dict)
-   
-    return faces_dict, edges_dict, vertices_dict
-
-def processHighestDim(topology, generate_mesh):
-    print('\n[PythonOCC] Using Highest Dim Only, trying with Solids...')
-    faces_dict = {}
-    edges_dict = {}
+def mapToList(shapes_map, cast):
+    return [cast(shapes_map.FindKey(i)) for i in range(1, shapes_map.Extent() + 1)]
 
-    done = False
-    for solid in tqdm(topology.solids()):
-        faces_dict, edges_dict, vertices_dict = addFacesAndAssociatedEdgesToDict(topology.faces_from_solids(solid), topology, faces_dict, edges_dict)   
-        done = True
+def processHighestDim(shape, topology, generate_mesh, face_workers=1, compact=False):
+    print('\n[PythonOCC] Using Highest Dim Only, trying with Solids...')
+    faces_map = mapSubShapes(tqdm(topology.solids()), TopAbs_FACE, TopTools_IndexedMapOfShape())
+    edges_map = TopTools_IndexedMapOfShape()
 
-    if not done:
+    if faces_map.Extent() == 0:
         print('\n[PythonOCC] There are no Solids, using Faces as highest dim...')
-        faces_dict, edges_dict, vertices_dict = addFacesAndAssociatedEdgesToDict(topology.faces(), topology, faces_dict, edges_dict)
-        done = (faces_dict != {})
+        topexp.MapShapes(shape, TopAbs_FACE, faces_map)
 
-        if not done == 0:
+        if faces_map.Extent() == 0:
             print('\n[PythonOCC] There are no Faces, using Curves as highest dim...')
-            edges_dict, vertices_dict = addEdgesAndAssociatedVerticesToDict(topology.edges(), edges_dict) 
-            done = (edges_dict != {})
+            topexp.MapShapes(shape, TopAbs_EDGE, edges_map)
 
-            if not done == 0:
+            if edges_map.Extent() == 0:
                 print('\n[PythonOCC] There are no Entities to use...')
-    
-    vertices = []
-    for key in vertices_dict:
-        vertices += vertices_dict[key]
-
-    edges= []
-    for key in edges_dict:
-        edges += edges_dict[key]
 
-    faces = []
-    for key in faces_dict:
-        faces += faces_dict[key]
+    faces = mapToList(faces_map, topods.Face)
+    edges = mapToList(mapSubShapes(faces, TopAbs_EDGE, edges_map), topods.Edge)
+    vertices = mapToList(mapSubShapes(edges, TopAbs_VERTEX, TopTools_IndexedMapOfShape()), topods.Vertex)
 
-    geometries_data, mesh = processEdgesAndFaces(vertices, edges, faces, topology, generate_mesh)
+    geometries_data, mesh = processEdgesAndFaces(vertices, edges, faces, generate_mesh, face_workers=face_workers, \
+                                                 compact=compact)
 
     return geometries_data, mesh
     
 
-def processNoHighestDim(topology, generate_mesh):
+def collectEntities(shape):
+    """ Returns the faces of a shape, the edges bounding them followed by the free edges, and their vertices """
+    faces = mapToList(mapSubShapes([shape], TopAbs_FACE, TopTools_IndexedMapOfShape()), topods.Face)
+    edges = mapToList(mapSubShapes([shape], TopAbs_EDGE, mapSubShapes(faces, TopAbs_EDGE, TopTools_IndexedMapOfShape())), \
+                      topods.Edge)
+    vertices = mapToList(mapSubShapes(edges, TopAbs_VERTEX, TopTools_IndexedMapOfShape()), topods.Vertex)
+    return vertices, edges, faces
+
+def meshSolidGroup(solid_group, mesh_parameters=None, triangle_budget=0, face_workers=1, compact=False):
+    """ Meshes a group of solids and maps its mesh, releasing the triangulation afterwards """
+    with stage('brep_mesh'):
+        OCCMeshGeneration(solid_group, mesh_parameters=mesh_parameters, triangle_budget=triangle_budget)
+    vertices, edges, faces = collectEntities(solid_group)
+    with stage('topology_index'):
+        topology_index = buildTopologyIndex(vertices, edges, faces)
+    with stage('mesh_mapping'):
+        mesh_data = computeMeshData(vertices, edges, faces, topology_index, workers=face_workers, compact=compact)
+    breptools_Clean(solid_group)
+    return mesh_data
+
+def meshSolidGroupByIndex(solid_groups_input, group_index):
+    solid_groups, mesh_parameters, triangle_budget, face_workers, compact = solid_groups_input
+    return meshSolidGroup(solid_groups[group_index], mesh_parameters=mesh_parameters, triangle_budget=triangle_budget, \
+                          face_workers=face_workers, compact=compact)
+
+def meshSolidGroups(solid_groups, mesh_parameters=None, triangle_budget=0, workers=1, face_workers=1, compact=False):
+    """ Yields the mesh data of every solid group, in order, meshing them in parallel when workers > 1 (the faces
+        of a group meshed in a worker are then read sequentially) """
+    return forkMap(meshSolidGroupByIndex, (solid_groups, mesh_parameters, triangle_budget, face_workers, compact), \
+                   len(solid_groups), workers=workers)
+
+def offsetIndices(indices, offset):
+    """ Offsets the non negative indices, lists are returned as lists and (compact) arrays as arrays """
+    array = np.asarray(indices, dtype=indices.dtype if isinstance(indices, np.ndarray) else np.int64)
+    array = np.where(array >= 0, array + offset, array).astype(array.dtype, copy=False)
+    return array if isinstance(indices, np.ndarray) else array.tolist()
+
+def freeEntities(shape, solids):
+    """ Returns the faces out of the solids and the edges out of any face """
+    solid_faces = mapSubShapes(solids, TopAbs_FACE, TopTools_IndexedMapOfShape())
+    faces = mapToList(mapSubShapes([shape], TopAbs_FACE, TopTools_IndexedMapOfShape()), topods.Face)
+    face_edges = mapSubShapes(faces, TopAbs_EDGE, TopTools_IndexedMapOfShape())
+    edges = mapToList(mapSubShapes([shape], TopAbs_EDGE, TopTools_IndexedMapOfShape()), topods.Edge)
+    return [face for face in faces if not solid_faces.Contains(face)] + \
+           [edge for edge in edges if not face_edges.Contains(edge)]
+
+def groupConnectedPieces(pieces, weights, max_weight) -> list:
+    """ Returns groups of piece indices. Pieces sharing edges (and so faces) are always in the same group,
+        so every curve and surface is mapped once. Connected components fill each group, in order, until
+        its weight would exceed max_weight """
+    parents = list(range(len(pieces)))
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    edges_map = TopTools_IndexedMapOfShape()
+    edge_owners = []
+    for i, piece in enumerate(pieces):
+        piece_edges = mapSubShapes([piece], TopAbs_EDGE, TopTools_IndexedMapOfShape())
+        for j in range(1, piece_edges.Extent() + 1):
+            edge_index = edges_map.Add(piece_edges.FindKey(j))
+            if edge_index > len(edge_owners):
+                edge_owners.append(i)
+            else:
+                parents[find(i)] = find(edge_owners[edge_index - 1])
+
+    components = {}
+    for i in range(len(pieces)):
+        components.setdefault(find(i), []).append(i)
+
+    groups = []
+    group_weight = 0
+    for component in components.values():
+        weight = sum(weights[i] for i in component)
+        if len(groups) == 0 or (group_weight > 0 and group_weight + weight > max_weight):
+            groups.append([])
+            group_weight = 0
+        groups[-1] += component
+        group_weight += weight
+    return [sorted(group) for group in groups]
+
+def processSolids(shape, solids, use_highest_dim=True, mesh_parameters=None, triangle_budget=0, solids_per_group=1, \
+                  workers=1, face_workers=1, compact=False):
+    """ Meshes and maps each group of solids on its own and merges them with offset indices, so the
+        triangulation in memory is bounded by the largest group. Solids sharing faces or edges are kept in
+        the same group. Without use_highest_dim the faces and edges out of the solids are processed too """
+    pieces = list(solids)
+    if not use_highest_dim:
+        pieces += freeEntities(shape, solids)
+    weights = [1]*len(solids) + [0]*(len(pieces) - len(solids))
+    groups = groupConnectedPieces(pieces, weights, solids_per_group)
+    print(f'\n[PythonOCC] Processing {len(solids)} Solids ({len(pieces) - len(solids)} free entities) in ' \
+          f'{len(groups)} groups of up to {solids_per_group} unconnected Solids...')
+
+    solid_groups = []
+    builder = BRep_Builder()
+    for group in groups:
+        solid_group = TopoDS_Compound()
+        builder.MakeCompound(solid_group)
+        for i in group:
+            builder.Add(solid_group, pieces[i])
+        solid_groups.append(solid_group)
+
+    group_triangle_budget = 0
+    if triangle_budget > 0:
+        group_triangle_budget = max(1, triangle_budget//len(solid_groups))
+
+    geometries_data = {'curves': [], 'surfaces': []}
+    vertex_dtype, index_dtype = meshDtypes(compact)
+    mesh_vertices = ArrayBuffer(3, vertex_dtype)
+    mesh_faces = ArrayBuffer(3, index_dtype)
+    groups_mesh_data = meshSolidGroups(solid_groups, mesh_parameters=mesh_parameters, triangle_budget=group_triangle_budget, \
+                                       workers=workers, face_workers=face_workers, compact=compact)
+    for solid_group, group_mesh_data in zip(solid_groups, tqdm(groups_mesh_data, total=len(solid_groups))):
+        group_vertices, group_faces, edges_mesh_data, faces_mesh_data = group_mesh_data
+        vertex_offset = len(mesh_vertices)
+        face_offset = len(mesh_faces)
+        mesh_vertices.extend(group_vertices)
+        mesh_faces.extend(group_faces + vertex_offset)
+
+        for edge_mesh_data in edges_mesh_data:
+            edge_mesh_data['vert_indices'] = offsetIndices(edge_mesh_data['vert_indices'], vertex_offset)
+        for face_mesh_data in faces_mesh_data:
+            face_mesh_data['vert_indices'] = offsetIndices(face_mesh_data['vert_indices'], vertex_offset)
+            face_mesh_data['face_indices'] = offsetIndices(face_mesh_data['face_indices'], face_offset)
+
+        _, edges, faces = collectEntities(solid_group)
+        with stage('geometry_creation'):
+            createGeometries(edges, faces, edges_mesh_data, faces_mesh_data, geometries_data=geometries_data)
+
+    mesh = {'vertices': mesh_vertices.toArray(), 'faces': mesh_faces.toArray()}
+    return geometries_data, mesh
+
+def processNoHighestDim(topology, generate_mesh, face_workers=1, compact=False):
     print('\n[PythonOCC] Using all the Shapes')
 
     vertices = [v for v in topology.vertices()]
     edges = [e for e in topology.edges()]
     faces = [f for f in topology.faces()]
 
-    geometries_data, mesh = processEdgesAndFaces(vertices, edges, faces, topology, generate_mesh)
+    geometries_data, mesh = processEdgesAndFaces(vertices, edges, faces, generate_mesh, face_workers=face_workers, \
+                                                 compact=compact)
 
     return geometries_data, mesh
 
+def writeShapeBinary(shape, filename: str):
+    if not bintools.Write(shape, filename):
+        raise IOError(f'[PythonOCC] Failed to write {filename}')
+
+def readShapeBinary(filename: str):
+    shape = TopoDS_Shape()
+    bintools.Read(shape, filename)
+    if shape.IsNull():
+        raise IOError(f'[PythonOCC] Failed to read {filename}')
+    return shape
+
+def hashShape(shape) -> str:
+    """ Returns the sha256 of the binary BRep of a shape """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'shape.bin')
+        writeShapeBinary(shape, filename)
+        return hashFile(filename)
+
+def OCCMeshGenerationWithCache(shape, mesh_parameters=None, triangle_budget=0, tessellation_cache=None, shape_hash=None):
+    """ Meshes the shape, or loads the meshed shape (BRep binary with triangulation) from the tessellation
+        cache, keyed by the shape hash and the mesh parameters. Returns the meshed shape """
+    if tessellation_cache is None:
+        OCCMeshGeneration(shape, mesh_parameters=mesh_parameters, triangle_budget=triangle_budget)
+        return shape
+
+    if shape_hash is None:
+        shape_hash = hashShape(shape)
+    key = computeModelKey(shape_hash, {'mesh_parameters': getHashedMeshParameters(mesh_parameters),
+                                             'triangle_budget': triangle_budget})
+    cached_filename = getCachedFile(tessellation_cache['dir'], key, '.bin')
+    if cached_filename is not None:
+        print('\n[PythonOCC] Loading mesh from tessellation cache...')
+        return readShapeBinary(cached_filename)
+
+    OCCMeshGeneration(shape, mesh_parameters=mesh_parameters, triangle_budget=triangle_budget)
+    putCachedFile(tessellation_cache['dir'], key, '.bin', lambda filename: writeShapeBinary(shape, filename),
+                  tessellation_cache['max_size'])
+    return shape
+
 # Generate features by dimensions
-def process(shape, generate_mesh=True, use_highest_dim=True):
+def process(shape, generate_mesh=True, use_highest_dim=True, mesh_parameters=None, triangle_budget=0, \
+            tessellation_cache=None, shape_hash=None, split_solids=False, solids_per_group=1, solid_workers=1, \
+            face_workers=1, compact=False):
     print('\n[PythonOCC] Topology Exploration to Generate Features by Dimension')
 
-    topology = TopologyExplorer(shape)
+    if generate_mesh and split_solids:
+        solids = [solid for solid in TopologyExplorer(shape).solids()]
+        if len(solids) > 0:
+            return processSolids(shape, solids, use_highest_dim=use_highest_dim, mesh_parameters=mesh_parameters, \
+                                 triangle_budget=triangle_budget, \
+                                 solids_per_group=solids_per_group, workers=solid_workers, face_workers=face_workers, \
+                                 compact=compact)
+        print('\n[PythonOCC] There are no Solids to split, processing the whole shape...')
 
     if generate_mesh:
-        OCCMeshGeneration(shape)
+        with stage('brep_mesh'):
+            shape = OCCMeshGenerationWithCache(shape, mesh_parameters=mesh_parameters, triangle_budget=triangle_budget, \
+                                               tessellation_cache=tessellation_cache, shape_hash=shape_hash)
+
+    topology = TopologyExplorer(shape)
     
     mesh = {}
     
     if use_highest_dim:
-        geometries_data, mesh = processHighestDim(topology, generate_mesh)
+        geometries_data, mesh = processHighestDim(shape, topology, generate_mesh, face_workers=face_workers, compact=compact)
     else:
-        geometries_data, mesh = processNoHighestDim(topology, generate_mesh)
+        geometries_data, mesh = processNoHighestDim(topology, generate_mesh, face_workers=face_workers, compact=compact)
 
     if mesh != {}:
         mesh['vertices'] = np.asarray(mesh['vertices'])
@@ -166,8 +308,9 @@ def process(shape, generate_mesh=True, use_highest_dim=True):
     
     return geometries_data, mesh
 
-def processPythonOCC(input_name: str, generate_mesh=True, use_highest_dim=True, scale_to_mm=1, debug=False) -> dict:
-    shape = read_step_file(input_name, verbosity=debug)
+def readAndHealShape(input_name: str, scale_to_mm=1, debug=False):
+    with stage('step_read'):
+        shape = read_step_file(input_name, verbosity=debug)
 
     scaling_transformation = gp_Trsf()
     scaling_transformation.SetScaleFactor(scale_to_mm)
@@ -175,9 +318,10 @@ def processPythonOCC(input_name: str, generate_mesh=True, use_highest_dim=True,
 
     shape = transform_builder.Shape()
 
-    healer = ShapeFix.ShapeFix_Shape(shape)
-    healer.Perform()
-    shape = healer.Shape()
+    with stage('shape_fix'):
+        healer = ShapeFix.ShapeFix_Shape(shape)
+        healer.Perform()
+        shape = healer.Shape()
 
     # extend_status = ShapeExtend_Status()
     # healer.Status(extend_status)
@@ -187,6 +331,42 @@ def processPythonOCC(input_name: str, generate_mesh=True, use_highest_dim=True,
     # else:
     #     print("Shape healing failed.")
 
-    geometries_data, mesh = process(shape, generate_mesh=generate_mesh, use_highest_dim=use_highest_dim)
+    return shape
+
+def readAndHealShapeWithCache(input_name: str, scale_to_mm=1, shape_cache=None, hash_shape=False, input_hash=None,
+                              debug=False):
+    """ Reads, scales and heals the STEP file, or loads the healed shape (BRep binary) from the shape cache,
+        keyed by the STEP content hash (input_hash, computed when not given) and scale_to_mm. Returns the shape
+        and, when hash_shape, the hash of its cached binary BRep (None otherwise or when the cache is disabled) """
+    if shape_cache is None:
+        return readAndHealShape(input_name, scale_to_mm=scale_to_mm, debug=debug), None
+
+    input_hash = hashFile(input_name) if input_hash is None else input_hash
+    key = computeModelKey(input_hash, {'scale_to_mm': scale_to_mm})
+    cached_filename = getCachedFile(shape_cache['dir'], key, '.bin')
+    if cached_filename is not None:
+        print('\n[PythonOCC] Loading healed shape from shape cache...')
+        with stage('shape_cache_read'):
+            return readShapeBinary(cached_filename), hashFile(cached_filename) if hash_shape else None
+
+    shape = readAndHealShape(input_name, scale_to_mm=scale_to_mm, debug=debug)
+    cached_filename = putCachedFile(shape_cache['dir'], key, '.bin', lambda filename: writeShapeBinary(shape, filename),
+                                    shape_cache['max_size'])
+    shape_hash = hashFile(cached_filename) if hash_shape and os.path.isfile(cached_filename) else None
+    return shape, shape_hash
+
+def processPythonOCC(input_name: str, generate_mesh=True, use_highest_dim=True, scale_to_mm=1, mesh_parameters=None, \
+                     triangle_budget=0, tessellation_cache=None, shape_cache=None, split_solids=False, solids_per_group=1, \
+                     solid_workers=1, face_workers=1, compact=False, input_hash=None, debug=False) -> dict:
+    # the shape hash is only the key of the tessellation cache, reading the BRep again is avoided without it
+    shape, shape_hash = readAndHealShapeWithCache(input_name, scale_to_mm=scale_to_mm, shape_cache=shape_cache, \
+                                                  hash_shape=(generate_mesh and tessellation_cache is not None), \
+                                                  input_hash=input_hash, debug=debug)
+
+    geometries_data, mesh = process(shape, generate_mesh=generate_mesh, use_highest_dim=use_highest_dim, \
+                                    mesh_parameters=mesh_parameters, triangle_budget=triangle_budget, \
+                                    tessellation_cache=tessellation_cache, shape_hash=shape_hash, \
+                                    split_solids=split_solids, solids_per_group=solids_per_group, \
+                                    solid_workers=solid_workers, face_workers=face_workers, compact=compact)
     
-    return shape, geometries_data, mesh
\ No newline at end of file
+    return shape, geometries_data, mesh
@@ -1,139 +1,233 @@
+import json
 import numpy as np
-from tqdm import tqdm
-import open3d as o3d
 
 
 def generate_area_from_surface(surface, vertices: np.array, faces: np.array) -> float:
     """ This function returns the area from the received surface """
     try:
         face_indices = surface["face_indices"]
-        vert_indices = np.unique(surface["vert_indices"])
+        vert_indices = surface["vert_indices"]
     except TypeError:
         face_indices = surface.face_indices
-        vert_indices = np.unique(surface.vert_indices)
+        vert_indices = surface.vert_indices
 
     if len(vert_indices) > 0 and len(face_indices) > 0:
-        vertices = vertices[vert_indices]
-        faces = faces[face_indices]
-
-        faces_n = []
-        for face in faces:
-            aux = np.hstack([np.where(vert_indices == vert)[0] for vert in face])
-            faces_n.append(aux)
-        faces_n = np.asarray(faces_n)
-
-        surface_mesh = o3d.geometry.TriangleMesh()
-        surface_mesh.vertices = o3d.utility.Vector3dVector(vertices)
-        surface_mesh.triangles = o3d.utility.Vector3iVector(faces_n)
-
-        return surface_mesh.get_surface_area()
+        faces = np.asarray(faces)[np.asarray(face_indices, dtype=np.int64)]
+        return float(computeTriangleAreas(np.asarray(vertices, dtype=np.float64), faces).sum())
 
     return 0.
 
 def generateStatisticsOld(features, mesh, only_stats=False):
+    vertices = np.asarray(mesh['vertices'], dtype=np.float64)
+    faces = np.asarray(mesh['faces'], dtype=np.int64)
     result = {}
-    result['number_vertices'] = len(mesh['vertices'])
-    result['number_faces'] = len(mesh['faces'])
+    result['number_vertices'] = len(vertices)
+    result['number_faces'] = len(faces)
     result['number_curves'] = len(features['curves'])
     result['number_surfaces'] = len(features['surfaces'])
-    
-    curves_dict = {}
-    surfaces_dict = {}
-
-    mesh_obj = o3d.geometry.TriangleMesh()
-    mesh_obj.vertices = o3d.utility.Vector3dVector(np.asarray(mesh['vertices']))
-    mesh_obj.triangles = o3d.utility.Vector3iVector(np.asarray(mesh['faces']))
 
-    result['bounding_box'] = mesh_obj.get_min_bound().tolist() + (mesh_obj.get_max_bound() - mesh_obj.get_min_bound()).tolist() 
+    result['bounding_box'] = computeBoundingBox(vertices)
 
-    print("Generating for curves: ")
-    for curve in tqdm(features["curves"]):
-        if curve is not None:
-            tp = curve["type"]
-            if tp not in curves_dict:
-                curves_dict[tp] = {'number_vertices': 0, 'number_curves': 0, 'number_void_curves': 0}
-            curves_dict[tp]['number_vertices'] += len(curve["vert_indices"])
-            curves_dict[tp]['number_curves'] += 1
+    index_arrays = featuresToIndexArrays(features)
+    curves = index_arrays['curves']
+    curves_dict = {}
+    curve_type_names, curve_type_ids = typeIds(curves['types'])
+    curve_counts = np.diff(curves['vert_indices'][1])
+    number_curves = np.bincount(curve_type_ids, minlength=len(curve_type_names))
+    number_vertices = np.bincount(curve_type_ids, weights=curve_counts, minlength=len(curve_type_names))
+    for i, tp in enumerate(curve_type_names):
+        curves_dict[tp] = {'number_vertices': int(number_vertices[i]), 'number_curves': int(number_curves[i]), \
+                           'number_void_curves': 0}
     result['curves'] = curves_dict
     result['number_void_curves'] = 0
-    surfaces_dict['area'] = 0.0
-    total_area_of_surfaces = 0.0
-    print("Generating for surfaces: ")
-    for surface in tqdm(features['surfaces']):
-        if surface is not None:
-            tp = surface["type"]
-            if tp not in surfaces_dict:
-                surfaces_dict[tp] = {'number_vertices': 0, 'number_faces': 0, 'number_surfaces': 0, 'number_void_surfaces': 0, 'area': 0}
-            # surface_area = generate_area_from_surface(surface, mesh_obj)
-            surface_area = generate_area_from_surface(surface, mesh["vertices"], mesh["faces"])
-            surfaces_dict[tp]['number_vertices'] += len(surface["vert_indices"])
-            surfaces_dict[tp]['number_faces'] += len(surface["face_indices"])
-            surfaces_dict[tp]['number_surfaces'] += 1
-            surfaces_dict[tp]['area'] += surface_area
-            total_area_of_surfaces += surface_area
-    surfaces_dict['area'] = total_area_of_surfaces
+
+    surfaces = index_arrays['surfaces']
+    surfaces_dict = {'area': 0.0}
+    surface_type_names, surface_type_ids = typeIds(surfaces['types'])
+    surface_vertices = np.diff(surfaces['vert_indices'][1])
+    surface_faces = np.diff(surfaces['face_indices'][1])
+    surface_labels, _ = computeLabels(index_arrays, len(vertices), len(faces))
+    surface_areas = computeSurfaceAreas(surface_labels, len(surfaces['types']), vertices, faces)
+    # the old statistics have no area for surfaces without vertices
+    surface_areas[surface_vertices == 0] = 0.
+    minlength = len(surface_type_names)
+    number_surfaces = np.bincount(surface_type_ids, minlength=minlength)
+    number_vertices = np.bincount(surface_type_ids, weights=surface_vertices, minlength=minlength)
+    number_faces = np.bincount(surface_type_ids, weights=surface_faces, minlength=minlength)
+    areas = np.bincount(surface_type_ids, weights=surface_areas, minlength=minlength)
+    for i, tp in enumerate(surface_type_names):
+        surfaces_dict[tp] = {'number_vertices': int(number_vertices[i]), 'number_faces': int(number_faces[i]), \
+                             'number_surfaces': int(number_surfaces[i]), 'number_void_surfaces': 0, 'area': float(areas[i])}
+    surfaces_dict['area'] = float(surface_areas.sum())
     result['surfaces'] = surfaces_dict
     result['number_void_surfaces'] = 0
     return result
 
+def geometriesToIndexArrays(geometries_data: dict) -> dict:
+    """ Converts the mesh info of bound geometries to the index arrays used by computeStatistics """
+    index_arrays = {}
+    for group, keys in [('curves', ['vert_indices']), ('surfaces', ['vert_indices', 'face_indices'])]:
+        entities = [g for g in geometries_data[group] if g is not None and g['geometry'] is not None]
+        # unbound geometries have their mesh info in a SubmeshView
+        mesh_infos = [g['mesh_view'].getMeshInfo() if g.get('mesh_view') is not None else g['geometry'].getMeshInfo() \
+                      for g in entities]
+        group_arrays = {'count': len(geometries_data[group]), 'types': [g['geometry'].getType() for g in entities]}
+        for key in keys:
+            group_arrays[key] = flattenIndices([info[key] if info is not None else None for info in mesh_infos])
+        index_arrays[group] = group_arrays
+    return index_arrays
+
 def generateStatistics(geometries_data, mesh):
+    index_arrays = geometriesToIndexArrays(geometries_data)
+    return computeStatistics(index_arrays, np.asarray(mesh.vertices), np.asarray(mesh.triangles))
+
+def flattenIndices(lists):
+    """ Returns a list of index lists (None for missing ones) as a flat array and per-entity offsets """
+    counts = np.array([len(l) if l is not None else 0 for l in lists], dtype=np.int64)
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    non_empty = [np.asarray(l, dtype=np.int64).reshape(-1) for l in lists if l is not None and len(l) > 0]
+    flat = np.concatenate(non_empty) if len(non_empty) > 0 else np.zeros(0, dtype=np.int64)
+    return flat, offsets
+
+def featuresToIndexArrays(features: dict) -> dict:
+    """ Converts a features dict to the index arrays used by computeStatistics """
+    index_arrays = {}
+    for group, keys in [('curves', ['vert_indices']), ('surfaces', ['vert_indices', 'face_indices'])]:
+        entities = [e for e in features[group] if e is not None]
+        group_arrays = {'count': len(features[group]), 'types': [e['type'] for e in entities]}
+        for key in keys:
+            group_arrays[key] = flattenIndices([e.get(key) for e in entities])
+        index_arrays[group] = group_arrays
+    return index_arrays
+
+def columnarToIndexArrays(arrays: dict) -> dict:
+    """ Gets the index arrays used by computeStatistics straight from the columns of a npz features file """
+    schema = json.loads(str(arrays['schema']))
+    index_arrays = {}
+    for group, keys in [('curves', ['vert_indices']), ('surfaces', ['vert_indices', 'face_indices'])]:
+        count = schema.get(group, {}).get('count', 0)
+        columns = schema.get(group, {}).get('columns', {})
+        types = np.asarray(arrays[f'{group}/type/values']).tolist() if columns.get('type') == 'string' else [''] * count
+        group_arrays = {'count': count, 'types': types}
+        for key in keys:
+            counts = np.zeros(count, dtype=np.int64)
+            flat = np.zeros(0, dtype=np.int64)
+            if columns.get(key) == 'array':
+                prefix = f'{group}/{key}/'
+                valid = np.asarray(arrays[prefix + 'presence'], dtype=bool)
+                if (prefix + 'none') in arrays:
+                    valid = valid & ~np.asarray(arrays[prefix + 'none'], dtype=bool)
+                counts[valid] = np.diff(np.asarray(arrays[prefix + 'offsets']))
+                flat = np.asarray(arrays[prefix + 'values']).reshape(-1)
+            offsets = np.zeros(count + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(counts)
+            group_arrays[key] = (flat, offsets)
+        index_arrays[group] = group_arrays
+    return index_arrays
+
+def computeTriangleAreas(vertices, faces):
+    if len(faces) == 0:
+        return np.zeros(0, dtype=np.float64)
+    triangles = vertices[faces]
+    return 0.5*np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1)
+
+def computeBoundingBox(vertices) -> list:
+    # same of open3d get_min_bound/get_max_bound, zeros for an empty mesh
+    min_bound = vertices.min(axis=0) if len(vertices) > 0 else np.zeros(3)
+    max_bound = vertices.max(axis=0) if len(vertices) > 0 else np.zeros(3)
+    return min_bound.tolist() + (max_bound - min_bound).tolist()
+
+def typeIds(types: list):
+    """ Returns the type names, in order of first appearance, and the type id of each entity """
+    type_names = list(dict.fromkeys(types))
+    index = {tp: i for i, tp in enumerate(type_names)}
+    return type_names, np.array([index[tp] for tp in types], dtype=np.int64)
+
+def segmentLabels(offsets):
+    """ Returns the segment of each position of a flat array given the offsets of the segments """
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+def computeLabels(index_arrays: dict, number_vertices: int, number_faces: int):
+    """ Returns the surface of each triangle and the curve of each vertex (-1 for none). A vertex shared
+        by curves gets the last one """
+    face_indices, face_offsets = index_arrays['surfaces']['face_indices']
+    surface_labels = np.full(number_faces, -1, dtype=np.int64)
+    surface_labels[face_indices] = segmentLabels(face_offsets)
+    vert_indices, vert_offsets = index_arrays['curves']['vert_indices']
+    curve_labels = np.full(number_vertices, -1, dtype=np.int64)
+    curve_labels[vert_indices] = segmentLabels(vert_offsets)
+    return surface_labels, curve_labels
+
+def computeSurfaceAreas(surface_labels, number_surfaces, vertices, faces):
+    """ Returns the area of every surface, computing the triangle areas once and reducing them by surface label """
+    labeled = surface_labels >= 0
+    triangle_areas = computeTriangleAreas(vertices, faces)
+    return np.bincount(surface_labels[labeled], weights=triangle_areas[labeled], minlength=number_surfaces)
+
+def computeCurveLengths(vert_arrays, vertices):
+    """ Returns the polyline length of every curve following the order of its vertices """
+    vert_indices, vert_offsets = vert_arrays
+    number_curves = len(vert_offsets) - 1
+    if len(vert_indices) < 2:
+        return np.zeros(number_curves, dtype=np.float64)
+    segment_lengths = np.linalg.norm(vertices[vert_indices[1:]] - vertices[vert_indices[:-1]], axis=1)
+    labels = segmentLabels(vert_offsets)
+    # segments joining the last vertex of a curve to the first of the next one are discarded
+    same_curve = labels[1:] == labels[:-1]
+    return np.bincount(labels[1:][same_curve], weights=segment_lengths[same_curve], minlength=number_curves)
+
+def computeStatistics(index_arrays: dict, vertices, faces) -> dict:
+    """ Computes the statistics of a model from the index arrays of its curves and surfaces """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
     result = {}
-    result['number_vertices'] = len(mesh.vertices)
-    result['number_faces'] = len(mesh.triangles)
-    result['number_curves'] = len(geometries_data['curves'])
-    result['number_surfaces'] = len(geometries_data['surfaces'])
+    result['number_vertices'] = len(vertices)
+    result['number_faces'] = len(faces)
+    result['number_curves'] = index_arrays['curves']['count']
+    result['number_surfaces'] = index_arrays['surfaces']['count']
 
-    result['bounding_box'] = mesh.get_min_bound().tolist() + (mesh.get_max_bound() - mesh.get_min_bound()).tolist() 
+    result['bounding_box'] = computeBoundingBox(vertices)
 
+    surface_labels, _ = computeLabels(index_arrays, len(vertices), len(faces))
+
+    curves = index_arrays['curves']
     curves_dict = {}
+    curve_type_names, curve_type_ids = typeIds(curves['types'])
+    curve_vertices = np.diff(curves['vert_indices'][1])
+    curve_void = curve_vertices == 0
+    curve_lengths = computeCurveLengths(curves['vert_indices'], vertices)
+    minlength = len(curve_type_names)
+    number_curves = np.bincount(curve_type_ids, minlength=minlength)
+    number_void_curves = np.bincount(curve_type_ids, weights=curve_void, minlength=minlength)
+    number_vertices = np.bincount(curve_type_ids, weights=curve_vertices, minlength=minlength)
+    lengths = np.bincount(curve_type_ids, weights=curve_lengths, minlength=minlength)
+    for i, tp in enumerate(curve_type_names):
+        curves_dict[tp] = {'number_vertices': int(number_vertices[i]), 'number_curves': int(number_curves[i]), \
+                           'number_void_curves': int(number_void_curves[i]), 'length': float(lengths[i])}
+
+    surfaces = index_arrays['surfaces']
     surfaces_dict = {}
-
-    print("Generating for curves: ")
-    for curve in tqdm(geometries_data["curves"]):
-        if curve['geometry'] is not None:
-            tp = curve['geometry'].getType()
-            if tp not in curves_dict:
-                curves_dict[tp] = {'number_vertices': 0, 'number_curves': 0, 'number_void_curves': 0}
-            
-            mesh_info = curve['geometry'].getMeshInfo()
-            curves_dict[tp]['number_curves'] += 1
-            
-            if mesh_info is not None and len(mesh_info['vert_indices']) > 0:
-                curves_dict[tp]['number_vertices'] += len(mesh_info['vert_indices'])
-                mesh = curve['geometry'].getMesh()
-                if mesh is not None:
-                    # perimeter
-                    pass
-            else:
-                curves_dict[tp]['number_void_curves'] += 1
-
-    number_void_curves = sum([curves_dict[tp]['number_void_curves'] for tp in curves_dict.keys()])
-
-    print("Generating for surfaces: ")
-    for surface in tqdm(geometries_data['surfaces']):
-        if surface['geometry'] is not None:
-            tp = surface['geometry'].getType()
-            if tp not in surfaces_dict:
-                surfaces_dict[tp] = {'number_vertices': 0, 'number_faces': 0, 'number_surfaces': 0, 'number_void_surfaces': 0, 'area': 0}
-            
-            mesh_info = surface['geometry'].getMeshInfo()
-            surfaces_dict[tp]['number_surfaces'] += 1
-            
-            if mesh_info is not None and len(mesh_info['face_indices']) > 0:
-                surfaces_dict[tp]['number_vertices'] += len(mesh_info['vert_indices'])
-                surfaces_dict[tp]['number_faces'] += len(mesh_info['face_indices'])
-                mesh = surface['geometry'].getMesh()
-                if mesh is not None:
-                    surfaces_dict[tp]['area'] += mesh.get_surface_area()
-            else:
-                surfaces_dict[tp]['number_void_surfaces'] += 1
-
-    total_area_of_surfaces = sum([surfaces_dict[tp]['area'] for tp in surfaces_dict.keys()])
-    number_void_surfaces = sum([surfaces_dict[tp]['number_void_surfaces'] for tp in surfaces_dict.keys()])
-    surfaces_dict['area'] = total_area_of_surfaces
-    
-    result['number_void_curves'] = number_void_curves
-    result['number_void_surfaces'] = number_void_surfaces
+    surface_type_names, surface_type_ids = typeIds(surfaces['types'])
+    surface_faces = np.diff(surfaces['face_indices'][1])
+    surface_void = surface_faces == 0
+    # vertices of void surfaces are not counted
+    surface_vertices = np.where(surface_void, 0, np.diff(surfaces['vert_indices'][1]))
+    surface_areas = computeSurfaceAreas(surface_labels, len(surfaces['types']), vertices, faces)
+    minlength = len(surface_type_names)
+    number_surfaces = np.bincount(surface_type_ids, minlength=minlength)
+    number_void_surfaces = np.bincount(surface_type_ids, weights=surface_void, minlength=minlength)
+    number_vertices = np.bincount(surface_type_ids, weights=surface_vertices, minlength=minlength)
+    number_faces = np.bincount(surface_type_ids, weights=surface_faces, minlength=minlength)
+    areas = np.bincount(surface_type_ids, weights=surface_areas, minlength=minlength)
+    for i, tp in enumerate(surface_type_names):
+        surfaces_dict[tp] = {'number_vertices': int(number_vertices[i]), 'number_faces': int(number_faces[i]), \
+                             'number_surfaces': int(number_surfaces[i]), \
+                             'number_void_surfaces': int(number_void_surfaces[i]), 'area': float(areas[i])}
+    surfaces_dict['area'] = float(areas.sum())
+
+    result['number_void_curves'] = int(curve_void.sum())
+    result['number_void_surfaces'] = int(surface_void.sum())
     result['curves'] = curves_dict
     result['surfaces'] = surfaces_dict
-    return result
\ No newline at end of file
+    return result
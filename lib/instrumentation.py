@@ -0,0 +1,99 @@
+import os
+import csv
+import json
+import time
+import threading
+import contextlib
+
+# Per model stage timings and counters. The pipeline calls stage() and count(), which record into the
+# instrumentation started in the current thread (they do nothing when there is none), so the library
+# functions do not need to pass it around. In --pipelined mode the writer thread records into the
+# instrumentation carried by the outputs of the model instead.
+
+CURRENT = threading.local()
+
+RUN_LOG_PREFIX = 'run_'
+
+class Instrumentation:
+    """ Accumulated wall time in seconds of each stage and counters of one model """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.) + time.perf_counter() - start
+
+    def count(self, name: str, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, record: dict):
+        """ Adds a record of another instrumentation, e.g. from a worker process """
+        for name, value in record.get('timings', {}).items():
+            self.timings[name] = self.timings.get(name, 0.) + value
+        for name, value in record.get('counters', {}).items():
+            self.count(name, value)
+
+    def record(self) -> dict:
+        return {'timings': dict(self.timings), 'counters': dict(self.counters)}
+
+def startInstrumentation() -> Instrumentation:
+    instrumentation = Instrumentation()
+    CURRENT.instrumentation = instrumentation
+    return instrumentation
+
+def stopInstrumentation():
+    CURRENT.instrumentation = None
+
+def currentInstrumentation():
+    return getattr(CURRENT, 'instrumentation', None)
+
+def stage(name: str):
+    """ Context manager timing a stage of the current model """
+    instrumentation = currentInstrumentation()
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.stage(name)
+
+def count(name: str, value=1):
+    instrumentation = currentInstrumentation()
+    if instrumentation is not None:
+        instrumentation.count(name, value)
+
+class RunLog:
+    """ Per run log of the model records. Every record is appended as a JSON line as soon as the model
+        is done (so an interrupted run keeps them) and a CSV with one column per timing and counter is
+        written when the log is closed """
+    def __init__(self, folder: str, run_name=None):
+        run_name = run_name if run_name is not None else time.strftime('%Y%m%d_%H%M%S')
+        self.jsonl_name = os.path.join(folder, f'{RUN_LOG_PREFIX}{run_name}.jsonl')
+        self.csv_name = os.path.join(folder, f'{RUN_LOG_PREFIX}{run_name}.csv')
+        self.file = open(self.jsonl_name, 'a')
+        self.rows = []
+
+    def add(self, name: str, record: dict):
+        row = {'name': name}
+        row.update(record)
+        self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+        self.rows.append(row)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        timing_names, counter_names = [], []
+        for row in self.rows:
+            timing_names += [n for n in row.get('timings', {}) if n not in timing_names]
+            counter_names += [n for n in row.get('counters', {}) if n not in counter_names]
+        with open(self.csv_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'status'] + [f'time_{n}' for n in timing_names] + counter_names)
+            for row in self.rows:
+                timings, counters = row.get('timings', {}), row.get('counters', {})
+                writer.writerow([row['name'], row.get('status', '')] + [timings.get(n, '') for n in timing_names] + \
+                                [counters.get(n, '') for n in counter_names])
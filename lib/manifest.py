@@ -0,0 +1,146 @@
+import json
+import time
+import sqlite3
+
+# Dataset manifest, a SQLite file kept up to date by the generator as models finish. Resume checks,
+# dataset filtering and statistics aggregation are queries on it instead of directory scans, e.g.
+#   SELECT name FROM entity_counts WHERE category = 'surface' AND type = 'Cylinder' AND count > 50
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    input_hash TEXT,
+    input_size INTEGER,
+    input_mtime_ns INTEGER,
+    key TEXT,
+    parameters TEXT,
+    number_vertices INTEGER,
+    number_faces INTEGER,
+    number_curves INTEGER,
+    number_surfaces INTEGER,
+    number_void_curves INTEGER,
+    number_void_surfaces INTEGER,
+    area REAL,
+    bbox_min_x REAL, bbox_min_y REAL, bbox_min_z REAL,
+    bbox_max_x REAL, bbox_max_y REAL, bbox_max_z REAL,
+    mesh_file TEXT,
+    features_file TEXT,
+    stats_file TEXT,
+    timings TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS entity_counts (
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    type TEXT NOT NULL,
+    count INTEGER,
+    void_count INTEGER,
+    number_vertices INTEGER,
+    number_faces INTEGER,
+    area REAL,
+    PRIMARY KEY (name, category, type)
+);
+CREATE INDEX IF NOT EXISTS entity_counts_type ON entity_counts (category, type, count);
+"""
+
+ENTRY_COLUMNS = {'input_hash': 'input_hash', 'size': 'input_size', 'mtime_ns': 'input_mtime_ns', 'key': 'key'}
+
+class Manifest:
+    """ SQLite index of the generated models, their inputs, parameters, counts, outputs and timings """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(MANIFEST_SCHEMA)
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM models').fetchone()[0]
+
+    def getEntries(self) -> dict:
+        """ Returns {name: entry} with the input hash, size, modification time, cache key and outputs of every model """
+        entries = {}
+        for row in self.connection.execute('SELECT name, input_hash, input_size, input_mtime_ns, key, mesh_file, '
+                                           'features_file, stats_file FROM models'):
+            entries[row['name']] = {'input_hash': row['input_hash'], 'size': row['input_size'],
+                                    'mtime_ns': row['input_mtime_ns'], 'key': row['key'],
+                                    'mesh_file': row['mesh_file'], 'features_file': row['features_file'],
+                                    'stats_file': row['stats_file']}
+        return entries
+
+    def setEntry(self, name: str, entry: dict, parameters=None, outputs=None):
+        """ Inserts or updates the input and output information of a model """
+        values = {column: entry.get(key) for key, column in ENTRY_COLUMNS.items()}
+        values['parameters'] = json.dumps(parameters, sort_keys=True) if parameters is not None else None
+        values['updated'] = time.time()
+        if outputs is not None:
+            values.update({'mesh_file': outputs.get('mesh_file'), 'features_file': outputs.get('features_file'),
+                           'stats_file': outputs.get('stats_file')})
+        self.upsert(name, values)
+
+    def upsert(self, name: str, values: dict):
+        columns = list(values.keys())
+        self.connection.execute(
+            f'INSERT INTO models (name, {", ".join(columns)}) VALUES (?, {", ".join("?" for _ in columns)}) '
+            f'ON CONFLICT(name) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns)}',
+            [name] + [values[c] for c in columns])
+
+    def setStats(self, name: str, stats: dict):
+        """ Updates the counts, bounding box and per type entity counts of a model from its statistics """
+        values = {}
+        for key in ['number_vertices', 'number_faces', 'number_curves', 'number_surfaces', 'number_void_curves',
+                    'number_void_surfaces']:
+            values[key] = stats.get(key)
+        values['area'] = stats.get('surfaces', {}).get('area')
+        bounding_box = stats.get('bounding_box')
+        if bounding_box is not None and len(bounding_box) == 6:
+            for i, axis in enumerate(['x', 'y', 'z']):
+                values[f'bbox_min_{axis}'] = bounding_box[i]
+                values[f'bbox_max_{axis}'] = bounding_box[i] + bounding_box[i + 3]
+        self.upsert(name, values)
+
+        self.connection.execute('DELETE FROM entity_counts WHERE name = ?', (name,))
+        rows = []
+        for tp, data in stats.get('curves', {}).items():
+            if isinstance(data, dict):
+                rows.append((name, 'curve', tp, data.get('number_curves', 0), data.get('number_void_curves', 0),
+                             data.get('number_vertices', 0), None, data.get('length')))
+        for tp, data in stats.get('surfaces', {}).items():
+            if isinstance(data, dict):
+                rows.append((name, 'surface', tp, data.get('number_surfaces', 0), data.get('number_void_surfaces', 0),
+                             data.get('number_vertices', 0), data.get('number_faces', 0), data.get('area')))
+        self.connection.executemany('INSERT INTO entity_counts VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def setModel(self, name: str, entry: dict, parameters: dict, result: dict):
+        """ Records a generated model given the result returned by the generator """
+        self.setEntry(name, entry, parameters=parameters, outputs=result)
+        if result.get('timings') is not None:
+            self.upsert(name, {'timings': json.dumps(result['timings'])})
+        if result.get('stats') is not None:
+            self.setStats(name, result['stats'])
+
+    def removeModel(self, name: str):
+        self.connection.execute('DELETE FROM models WHERE name = ?', (name,))
+        self.connection.execute('DELETE FROM entity_counts WHERE name = ?', (name,))
+
+    def findModels(self, category: str, tp: str, min_count=1) -> list:
+        """ Returns the names of the models with at least min_count curves or surfaces of a type """
+        rows = self.connection.execute('SELECT name FROM entity_counts WHERE category = ? AND type = ? AND count >= ? '
+                                       'ORDER BY name', (category, tp, min_count))
+        return [row['name'] for row in rows]
+
+    def query(self, sql: str, parameters=()) -> list:
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
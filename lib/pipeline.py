@@ -0,0 +1,65 @@
+import queue
+import threading
+
+PREFETCH_CHUNK_SIZE = 2**20
+
+class OrderedWriter:
+    """ Runs write tasks on a single background thread, in submission order. At most max_pending tasks wait
+        in the queue, submit blocks beyond that. After a task fails the remaining ones are skipped and the
+        error is raised by the next submit or checkError """
+    def __init__(self, max_pending=1):
+        self.tasks = queue.Queue(maxsize=max(max_pending, 1))
+        self.results = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.tasks.get()
+            if item is None:
+                break
+            key, function, args = item
+            if self.error is not None:
+                continue
+            try:
+                self.results.put((key, function(*args)))
+            except BaseException as error:
+                self.error = (key, error)
+
+    def checkError(self):
+        if self.error is not None:
+            key, error = self.error
+            raise RuntimeError(f'writing the outputs of {key} failed: {error}') from error
+
+    def submit(self, key, function, *args):
+        self.checkError()
+        self.tasks.put((key, function, args))
+
+    def completed(self) -> list:
+        """ Returns the (key, result) of the tasks finished since the last call """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        """ Waits for the pending tasks to finish """
+        if self.thread.is_alive():
+            self.tasks.put(None)
+            self.thread.join()
+
+def prefetchFile(filename: str):
+    """ Reads a file in a background thread, so it is in the page cache when it is opened """
+    def read():
+        try:
+            with open(filename, 'rb') as f:
+                while f.read(PREFETCH_CHUNK_SIZE):
+                    pass
+        except OSError:
+            pass
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,147 @@
+import numpy as np
+
+# Binary little endian PLY reader and writer working on numpy arrays. Triangle meshes with any scalar
+# vertex/face properties are read with memory mapping, the vertices and faces returned are views on the file.
+
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': '<i2', 'int16': '<i2', 'ushort': '<u2', 'uint16': '<u2',
+    'int': '<i4', 'int32': '<i4', 'uint': '<u4', 'uint32': '<u4',
+    'float': '<f4', 'float32': '<f4', 'double': '<f8', 'float64': '<f8',
+}
+NUMPY_TO_PLY = {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort', 'i4': 'int', 'u4': 'uint',
+                'f4': 'float', 'f8': 'double'}
+
+WRITE_CHUNK_SIZE = 2**20
+
+def propertyDtype(values):
+    """ PLY has no 64-bit integers, they are written as int """
+    dtype = np.asarray(values).dtype
+    if dtype.kind == 'b':
+        return np.dtype('u1')
+    if dtype.kind in 'iu' and dtype.itemsize == 8:
+        return np.dtype('<i4')
+    return dtype.newbyteorder('<')
+
+def readPLYHeader(f):
+    """ Returns the format, the elements [(name, count, properties)] and the size of the header.
+        Properties are (name, type) or (name, (count_type, item_type)) for lists """
+    if f.readline().strip() != b'ply':
+        raise ValueError('not a PLY file')
+    ply_format = None
+    elements = []
+    while True:
+        line = f.readline()
+        if line == b'':
+            raise ValueError('PLY header without end_header')
+        words = line.decode('ascii', errors='replace').split()
+        if len(words) == 0 or words[0] in ['comment', 'obj_info']:
+            continue
+        if words[0] == 'end_header':
+            break
+        if words[0] == 'format':
+            ply_format = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property':
+            if words[1] == 'list':
+                elements[-1][2].append((words[4], (words[2], words[3])))
+            else:
+                elements[-1][2].append((words[2], words[1]))
+    return ply_format, elements, f.tell()
+
+def elementDtype(properties, list_size=3):
+    """ Returns the record dtype of an element, lists are taken as fixed size (triangles) """
+    fields = []
+    names = [name for name, _ in properties]
+    i = 0
+    while i < len(properties):
+        name, tp = properties[i]
+        if isinstance(tp, tuple):
+            fields.append((name + '_count', PLY_TYPES[tp[0]]))
+            fields.append((name, PLY_TYPES[tp[1]], (list_size,)))
+        elif names[i:(i + 3)] == ['x', 'y', 'z'] and all(t == tp for _, t in properties[i:(i + 3)]):
+            # grouped, so the vertices are a (n, 3) view of the records
+            fields.append(('xyz', PLY_TYPES[tp], (3,)))
+            i += 2
+        else:
+            fields.append((name, PLY_TYPES[tp]))
+        i += 1
+    return np.dtype(fields)
+
+def readPLY(filename: str, mmap=True) -> dict:
+    """ Reads a binary little endian triangle mesh PLY as {'vertices', 'faces', <other scalar properties>}.
+        Raises ValueError for other formats or non triangular faces """
+    with open(filename, 'rb') as f:
+        ply_format, elements, offset = readPLYHeader(f)
+    if ply_format != 'binary_little_endian':
+        raise ValueError(f'PLY format {ply_format} is not supported')
+
+    result = {}
+    for name, count, properties in elements:
+        dtype = elementDtype(properties)
+        if mmap and count > 0:
+            records = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            records = np.fromfile(filename, dtype=dtype, count=count, offset=offset)
+        offset += count*dtype.itemsize
+        if name == 'vertex':
+            if 'xyz' not in dtype.names:
+                raise ValueError('PLY vertices without x, y, z')
+            result['vertices'] = records['xyz']
+        elif name == 'face':
+            if 'vertex_indices' not in dtype.names and 'vertex_index' not in dtype.names:
+                raise ValueError('PLY faces without vertex indices')
+            indices_name = 'vertex_indices' if 'vertex_indices' in dtype.names else 'vertex_index'
+            if count > 0 and np.any(records[indices_name + '_count'] != 3):
+                raise ValueError('PLY faces are not triangles')
+            result['faces'] = records[indices_name]
+        else:
+            continue
+        for field in dtype.names:
+            if field not in ['xyz', 'vertex_indices', 'vertex_indices_count', 'vertex_index', 'vertex_index_count']:
+                result[field] = records[field]
+    result.setdefault('vertices', np.zeros((0, 3)))
+    result.setdefault('faces', np.zeros((0, 3), dtype=np.int32))
+    return result
+
+def writePLY(filename: str, vertices, faces, vertex_properties=None, face_properties=None):
+    """ Writes a binary little endian PLY, float32 vertices are written as float and others as double.
+        vertex_properties and face_properties are dicts of per-vertex and per-face scalar arrays """
+    vertices = np.asarray(vertices)
+    faces = np.asarray(faces)
+    vertex_properties = vertex_properties if vertex_properties is not None else {}
+    face_properties = face_properties if face_properties is not None else {}
+    vertices_type = '<f4' if vertices.dtype == np.float32 else '<f8'
+
+    vertex_fields = [('xyz', vertices_type, (3,))] + [(name, propertyDtype(p)) for name, p in vertex_properties.items()]
+    face_fields = [('vertex_indices_count', 'u1'), ('vertex_indices', '<i4', (3,))] + \
+                  [(name, propertyDtype(p)) for name, p in face_properties.items()]
+    vertex_dtype = np.dtype(vertex_fields)
+    face_dtype = np.dtype(face_fields)
+
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(vertices)}']
+    header += [f'property {NUMPY_TO_PLY[vertex_dtype["xyz"].base.str[1:]]} {axis}' for axis in 'xyz']
+    header += [f'property {NUMPY_TO_PLY[vertex_dtype[name].str[1:]]} {name}' for name in vertex_properties]
+    header += [f'element face {len(faces)}', 'property list uchar int vertex_indices']
+    header += [f'property {NUMPY_TO_PLY[face_dtype[name].str[1:]]} {name}' for name in face_properties]
+    header += ['end_header']
+
+    with open(filename, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        # the records are built in chunks, bounding the temporary memory
+        for start in range(0, len(vertices), WRITE_CHUNK_SIZE):
+            end = min(start + WRITE_CHUNK_SIZE, len(vertices))
+            records = np.empty(end - start, dtype=vertex_dtype)
+            records['xyz'] = vertices[start:end]
+            for name, p in vertex_properties.items():
+                records[name] = p[start:end]
+            records.tofile(f)
+        for start in range(0, len(faces), WRITE_CHUNK_SIZE):
+            end = min(start + WRITE_CHUNK_SIZE, len(faces))
+            records = np.empty(end - start, dtype=face_dtype)
+            records['vertex_indices_count'] = 3
+            records['vertex_indices'] = faces[start:end]
+            for name, p in face_properties.items():
+                records[name] = p[start:end]
+            records.tofile(f)
@@ -0,0 +1,237 @@
+import os
+import signal
+import time
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+from lib.instrumentation import startInstrumentation, stopInstrumentation, currentInstrumentation
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Status of a task executed by runIsolated
+TASK_DONE = 'done'
+TASK_ERROR = 'error'
+TASK_CRASH = 'crash'
+TASK_TIMEOUT = 'timeout'
+TASK_MEMORY = 'memory'
+
+def getChildrenPids(pid):
+    """ Returns the pids of all the descendants of a process (Linux only, empty elsewhere) """
+    children = []
+    try:
+        task_ids = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return children
+    for tid in task_ids:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children', 'r') as f:
+                children += [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+    descendants = list(children)
+    for child in children:
+        descendants += getChildrenPids(child)
+    return descendants
+
+def getProcessRSS(pid):
+    """ Returns the resident set size in bytes of a process, 0 if it is not available """
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1])*PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def getProcessTreeRSS(pid):
+    """ Returns the resident set size in bytes of a process and its descendants """
+    return sum(getProcessRSS(p) for p in [pid] + getChildrenPids(pid))
+
+def killProcessTree(process):
+    """ Kills a process and all its descendants """
+    pids = getChildrenPids(process.pid)
+    process.kill()
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+# a task killed or crashed is run again this many times on a fresh worker before its status is reported,
+# a worker left in a bad state by a previous task must not get a healthy task quarantined
+TASK_RETRIES = 1
+
+def workerLoop(connection, target):
+    """ Loop of a worker process, runs target on the received tasks until the pipe is closed or None is received """
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        try:
+            result = target(task)
+            connection.send((TASK_DONE, result))
+        except Exception:
+            connection.send((TASK_ERROR, traceback.format_exc()))
+    connection.close()
+
+def startWorker(context, target) -> dict:
+    connection, worker_connection = context.Pipe()
+    process = context.Process(target=workerLoop, args=(worker_connection, target))
+    process.start()
+    worker_connection.close()
+    return {'process': process, 'connection': connection, 'task': None, 'attempt': 0, 'start': None, 'start_rss': 0}
+
+def stopWorker(worker, kill=False, join_timeout=10.):
+    """ Stops a worker, killing it (and its descendants) when it runs a task or does not exit """
+    process = worker['process']
+    if not kill:
+        try:
+            worker['connection'].send(None)
+            process.join(join_timeout)
+        except OSError:
+            pass
+    if process.is_alive():
+        killProcessTree(process)
+    process.join()
+    worker['connection'].close()
+
+def checkWorker(worker, timeout, max_rss):
+    """ Returns the (status, payload) of the task of a worker, (None, None) while it runs. The memory limit
+        applies to the growth of the worker process tree since the task was sent. A worker that crashed or
+        exceeded a limit is dead (killed) when its status is returned """
+    process = worker['process']
+    if worker['connection'].poll():
+        try:
+            return worker['connection'].recv()
+        except EOFError:
+            process.join()
+            return TASK_CRASH, f'worker exited with code {process.exitcode}'
+    if not process.is_alive():
+        process.join()
+        return TASK_CRASH, f'worker exited with code {process.exitcode}'
+    if timeout > 0 and (time.time() - worker['start']) > timeout:
+        killProcessTree(process)
+        process.join()
+        return TASK_TIMEOUT, f'killed after {timeout} seconds'
+    if max_rss > 0:
+        rss = getProcessTreeRSS(process.pid) - worker['start_rss']
+        if rss > max_rss:
+            killProcessTree(process)
+            process.join()
+            return TASK_MEMORY, f'killed using {rss/2**20:.0f} MB'
+    return None, None
+
+def runIsolated(tasks, target, workers=1, timeout=0., max_rss=0, poll_interval=0.2):
+    """ Runs target(task) for each task in long-lived worker processes, at most workers at a time.
+
+    Each worker takes one task at a time through a pipe and is only replaced after it is killed
+    or crashes, so the interpreter startup and the imports are paid once per worker. A task that
+    runs more than timeout seconds or whose worker process tree grows more than max_rss bytes is
+    killed with its worker (0 disables each limit), and run again on a fresh worker up to
+    TASK_RETRIES times. Yields (task, status, payload) in completion order, where status is one of
+    TASK_DONE (payload is the return value), TASK_ERROR (payload is the traceback), TASK_CRASH,
+    TASK_TIMEOUT or TASK_MEMORY.
+    """
+    # spawn, so each worker loads its own PythonOCC and open3d state
+    context = multiprocessing.get_context('spawn')
+    pending = [(task, 0) for task in tasks]
+    pending.reverse()
+    pool = []
+    workers = max(workers, 1)
+
+    try:
+        while len(pending) > 0 or any(worker['task'] is not None for worker in pool):
+            # idle workers take the next tasks, new workers are started while there are free slots.
+            # Retried tasks always get a new worker, replacing an idle one when there is no free slot
+            while len(pending) > 0:
+                task, attempt = pending[-1]
+                idle = [worker for worker in pool if worker['task'] is None]
+                if attempt == 0 and len(idle) > 0:
+                    worker = idle[0]
+                elif len(pool) < workers or len(idle) > 0:
+                    if len(pool) >= workers:
+                        stopWorker(idle[0])
+                        pool.remove(idle[0])
+                    worker = startWorker(context, target)
+                    pool.append(worker)
+                else:
+                    break
+                pending.pop()
+                try:
+                    worker['connection'].send(task)
+                except OSError:
+                    # the worker died while idle, the task goes to another one
+                    pending.append((task, attempt))
+                    stopWorker(worker, kill=True)
+                    pool.remove(worker)
+                    continue
+                worker['task'] = task
+                worker['attempt'] = attempt
+                worker['start'] = time.time()
+                worker['start_rss'] = getProcessTreeRSS(worker['process'].pid) if max_rss > 0 else 0
+
+            busy = [worker for worker in pool if worker['task'] is not None]
+            multiprocessing.connection.wait([worker['connection'] for worker in busy] + \
+                                            [worker['process'].sentinel for worker in busy], timeout=poll_interval)
+
+            for worker in busy:
+                status, payload = checkWorker(worker, timeout, max_rss)
+                if status is None:
+                    continue
+                task = worker['task']
+                worker['task'] = None
+                if status in [TASK_DONE, TASK_ERROR]:
+                    yield task, status, payload
+                    continue
+                worker['connection'].close()
+                pool.remove(worker)
+                if worker['attempt'] < TASK_RETRIES:
+                    pending.append((task, worker['attempt'] + 1))
+                else:
+                    yield task, status, f'{payload} (after {worker["attempt"] + 1} attempts)'
+    finally:
+        # also reached when the caller stops early, no worker is left running
+        for worker in pool:
+            stopWorker(worker, kill=(worker['task'] is not None))
+
+# function and input of the forkMap running in the parent, inherited by its forked workers
+FORK_MAP_INPUT = None
+# set in the forkMap workers, which are daemonic and can not fork a pool of their own
+FORK_MAP_WORKER = False
+
+def initForkMapWorker():
+    global FORK_MAP_WORKER
+    FORK_MAP_WORKER = True
+
+def forkMapCall(index):
+    func, shared_input = FORK_MAP_INPUT
+    # the stages and counters of the worker are sent back with the result
+    instrumentation = startInstrumentation()
+    try:
+        result = func(shared_input, index)
+    finally:
+        stopInstrumentation()
+    return result, instrumentation.record()
+
+def forkMap(func, shared_input, n, workers=1, chunksize=1):
+    """ Yields func(shared_input, i) for i in range(n), in order. With workers > 1 the calls run in a pool of
+        forked processes, which inherit shared_input (e.g. TopoDS shapes, that can not be pickled) instead of
+        receiving it, and only the indices and the results are pickled. Nested calls run in the worker """
+    global FORK_MAP_INPUT
+    if workers <= 1 or n < 2 or FORK_MAP_WORKER or 'fork' not in multiprocessing.get_all_start_methods():
+        for index in range(n):
+            yield func(shared_input, index)
+        return
+
+    FORK_MAP_INPUT = (func, shared_input)
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=workers, initializer=initForkMapWorker) as pool:
+            for result, record in pool.imap(forkMapCall, range(n), chunksize=chunksize):
+                if currentInstrumentation() is not None:
+                    currentInstrumentation().merge(record)
+                yield result
+    finally:
+        FORK_MAP_INPUT = None
@@ -0,0 +1,223 @@
+import io
+import os
+import json
+import pickle
+import struct
+import yaml
+import numpy as np
+
+from lib.columnar import decodeFeatures
+
+# Shard file layout:
+#   SHARD_MAGIC
+#   records, each one: RECORD_MAGIC, uint64 header size, json header {'name', 'members': [[member, size, format]]}
+#                      and the members bytes, in the header order
+#   footer: FOOTER_MAGIC, uint64 index size, json index {name: {member: [offset, size, format]}}
+#   trailer: uint64 footer offset, END_MAGIC
+# Records are self-describing, so a shard that was not closed (no footer) is indexed by scanning them.
+# The latest record of a name wins, which lets regenerated models be appended again.
+
+SHARD_MAGIC = b'3DGDSHRD'
+RECORD_MAGIC = b'RECD'
+FOOTER_MAGIC = b'INDX'
+END_MAGIC = b'3DGDEND\x00'
+SHARD_EXTENSION = '.shard'
+
+UINT64 = struct.Struct('<Q')
+TRAILER_SIZE = UINT64.size + len(END_MAGIC)
+
+def listShards(folder: str) -> list:
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(SHARD_EXTENSION))
+
+def scanShardRecords(f, file_size):
+    """ Returns the index of the complete records of a shard and the offset where they end """
+    index = {}
+    offset = len(SHARD_MAGIC)
+    while offset + len(RECORD_MAGIC) + UINT64.size <= file_size:
+        f.seek(offset)
+        if f.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            break
+        header_size = UINT64.unpack(f.read(UINT64.size))[0]
+        data_offset = offset + len(RECORD_MAGIC) + UINT64.size + header_size
+        if data_offset > file_size:
+            break
+        try:
+            header = json.loads(f.read(header_size))
+        except ValueError:
+            break
+        members = {}
+        for member, size, fmt in header['members']:
+            members[member] = [data_offset, size, fmt]
+            data_offset += size
+        if data_offset > file_size:
+            break
+        index[header['name']] = members
+        offset = data_offset
+    return index, offset
+
+def readShardIndex(filename: str):
+    """ Returns the index {name: {member: [offset, size, format]}} of a shard and the offset where its records end """
+    with open(filename, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < len(SHARD_MAGIC) or f.read(len(SHARD_MAGIC)) != SHARD_MAGIC:
+            raise ValueError(f'{filename} is not a shard file')
+        if file_size >= len(SHARD_MAGIC) + TRAILER_SIZE:
+            f.seek(file_size - TRAILER_SIZE)
+            footer_offset = UINT64.unpack(f.read(UINT64.size))[0]
+            if f.read(len(END_MAGIC)) == END_MAGIC and footer_offset < file_size:
+                f.seek(footer_offset)
+                if f.read(len(FOOTER_MAGIC)) == FOOTER_MAGIC:
+                    index_size = UINT64.unpack(f.read(UINT64.size))[0]
+                    return json.loads(f.read(index_size)), footer_offset
+        # not closed, recovering the index from the records
+        return scanShardRecords(f, file_size)
+
+def arrayToBytes(array) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+class ShardWriter:
+    """ Appends models to the shard files of a folder, starting a new shard after max_shard_size bytes.
+        Each model is a dict of members, numpy arrays (stored as npy) or (bytes, format) tuples """
+    def __init__(self, folder: str, max_shard_size=2**30):
+        self.folder = folder
+        self.max_shard_size = max_shard_size
+        self.file = None
+        self.index = {}
+        os.makedirs(folder, exist_ok=True)
+        shards = listShards(folder)
+        if len(shards) > 0 and os.path.getsize(shards[-1]) < max_shard_size:
+            self.openShard(shards[-1], append=True)
+        else:
+            self.openShard(self.shardName(len(shards)))
+
+    def shardName(self, shard_id):
+        return os.path.join(self.folder, f'shard_{shard_id:05d}{SHARD_EXTENSION}')
+
+    def openShard(self, filename, append=False):
+        self.filename = filename
+        if append:
+            self.index, data_end = readShardIndex(filename)
+            self.file = open(filename, 'r+b')
+            # the footer is rewritten when the shard is closed
+            self.file.truncate(data_end)
+            self.file.seek(data_end)
+        else:
+            self.index = {}
+            self.file = open(filename, 'wb')
+            self.file.write(SHARD_MAGIC)
+
+    def closeShard(self):
+        if self.file is None:
+            return
+        index_bytes = json.dumps(self.index).encode()
+        footer_offset = self.file.tell()
+        self.file.write(FOOTER_MAGIC + UINT64.pack(len(index_bytes)) + index_bytes)
+        self.file.write(UINT64.pack(footer_offset) + END_MAGIC)
+        self.file.close()
+        self.file = None
+
+    def add(self, name: str, members: dict):
+        blobs = []
+        for member, value in members.items():
+            if isinstance(value, np.ndarray):
+                blobs.append((member, arrayToBytes(value), 'npy'))
+            else:
+                blobs.append((member, value[0], value[1]))
+        header_bytes = json.dumps({'name': name, 'members': [[m, len(b), fmt] for m, b, fmt in blobs]}).encode()
+
+        offset = self.file.tell() + len(RECORD_MAGIC) + UINT64.size + len(header_bytes)
+        self.file.write(RECORD_MAGIC + UINT64.pack(len(header_bytes)) + header_bytes)
+        entry = {}
+        for member, blob, fmt in blobs:
+            self.file.write(blob)
+            entry[member] = [offset, len(blob), fmt]
+            offset += len(blob)
+        self.file.flush()
+        self.index[name] = entry
+
+        if self.file.tell() >= self.max_shard_size:
+            shard_id = len(listShards(self.folder))
+            self.closeShard()
+            self.openShard(self.shardName(shard_id))
+
+    def close(self):
+        self.closeShard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ShardReader:
+    """ Random access by model name to the models of all the shards of a folder """
+    def __init__(self, folder: str):
+        self.models = {}
+        for filename in listShards(folder):
+            index, _ = readShardIndex(filename)
+            for name, members in index.items():
+                self.models[name] = (filename, members)
+
+    def names(self) -> list:
+        return sorted(self.models.keys())
+
+    def __len__(self):
+        return len(self.models)
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def members(self, name: str) -> dict:
+        return self.models[name][1]
+
+    def readBytes(self, name: str, member: str) -> bytes:
+        filename, members = self.models[name]
+        offset, size, _ = members[member]
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def loadArray(self, name: str, member: str, mmap=True):
+        """ Returns an array member, memory mapped from the shard file by default """
+        filename, members = self.models[name]
+        offset, size, fmt = members[member]
+        if fmt != 'npy':
+            raise ValueError(f'{member} of {name} is not an array')
+        if not mmap:
+            return np.load(io.BytesIO(self.readBytes(name, member)), allow_pickle=False)
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            data_offset = f.tell()
+        if len(shape) == 0 or 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', offset=data_offset, shape=shape, \
+                         order='F' if fortran_order else 'C')
+
+    def loadMesh(self, name: str, mmap=True) -> dict:
+        return {'vertices': self.loadArray(name, 'vertices', mmap=mmap),
+                'faces': self.loadArray(name, 'faces', mmap=mmap)}
+
+    def loadFeatures(self, name: str) -> dict:
+        data = self.readBytes(name, 'features')
+        fmt = self.members(name)['features'][2].lower()
+        if fmt in ['yaml', 'yml']:
+            return yaml.load(data, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+        elif fmt == 'pkl':
+            return pickle.loads(data)
+        elif fmt == 'npz':
+            with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+                return decodeFeatures({key: arrays[key] for key in arrays.files})
+        else:
+            return json.loads(data)
+
+    def loadStats(self, name: str) -> dict:
+        return json.loads(self.readBytes(name, 'stats'))
@@ -0,0 +1,44 @@
+import numpy as np
+import open3d as o3d
+
+def open3dMesh(global_mesh):
+    """ Returns the global mesh as an open3d mesh. A dict of (compact) vertices and faces is converted at the
+        first call and the result is kept in it, so all the views of the mesh share it """
+    if not isinstance(global_mesh, dict):
+        return global_mesh
+    if 'open3d' not in global_mesh:
+        mesh = o3d.geometry.TriangleMesh()
+        mesh.vertices = o3d.utility.Vector3dVector(np.asarray(global_mesh['vertices'], dtype=np.float64))
+        mesh.triangles = o3d.utility.Vector3iVector(np.asarray(global_mesh['faces'], dtype=np.int32))
+        global_mesh['open3d'] = mesh
+    return global_mesh['open3d']
+
+class SubmeshView:
+    """ Mesh of a curve or surface given by its indices in the shared global mesh. Nothing is copied until
+        the view is bound to its geometry or its own submesh is asked for with getMesh """
+    def __init__(self, global_mesh, mesh_data: dict):
+        self.global_mesh = global_mesh
+        self.mesh_data = mesh_data
+        self.mesh = None
+
+    def getMeshInfo(self) -> dict:
+        return self.mesh_data
+
+    def getMesh(self):
+        """ Returns the view as an open3d mesh with local vertex indices, built at the first call """
+        if self.mesh is None:
+            global_mesh = open3dMesh(self.global_mesh)
+            face_indices = np.asarray(self.mesh_data.get('face_indices', []), dtype=np.int64).reshape(-1)
+            triangles = np.asarray(global_mesh.triangles)[face_indices]
+            used, local_triangles = np.unique(triangles, return_inverse=True)
+            self.mesh = o3d.geometry.TriangleMesh()
+            self.mesh.vertices = o3d.utility.Vector3dVector(np.asarray(global_mesh.vertices)[used])
+            self.mesh.triangles = o3d.utility.Vector3iVector(local_triangles.reshape(-1, 3).astype(np.int32))
+        return self.mesh
+
+    def bind(self, geometry):
+        """ Sets the mesh of the view in a geometry, done only right before the geometry is serialized """
+        # compact mesh data is kept in arrays up to here, the features have lists
+        mesh_data = {key: values.tolist() if isinstance(values, np.ndarray) else values \
+                     for key, values in self.mesh_data.items()}
+        geometry.setMeshByGlobal(open3dMesh(self.global_mesh), mesh_data)
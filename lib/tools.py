@@ -1,4 +1,5 @@
 import os
+import io
 import numpy as np
 import pickle
 import json
@@ -8,9 +9,12 @@ from pathlib import Path
 
 from OCC.Core.gp import gp_Trsf, gp_Vec, gp_Quaternion, gp_Mat
 
+from lib.columnar import writeColumnar, writeColumnarArrays, loadColumnar, ColumnarBuilder
+from lib.ply import writePLY, readPLY
+
 CAD_FORMATS = ['.step', '.stp', '.STEP']
 MESH_FORMATS = ['.OBJ', '.obj']
-FEATURES_FORMATS = ['.pkl', '.PKL', '.yml', '.yaml', '.YAML', '.json', '.JSON']
+FEATURES_FORMATS = ['.pkl', '.PKL', '.yml', '.yaml', '.YAML', '.json', '.JSON', '.npz', '.NPZ']
 
 # Convert a float to string
 def float2str(number, limit = 10) -> str:
@@ -25,58 +29,67 @@ def float2str(number, limit = 10) -> str:
     else:
         return str(number)
 
-# Convert a list to string
+# Convert a list to string, wrapping the lines after LINE_SIZE - len(prefix) characters
 def list2str(l: list, prefix, LINE_SIZE = 90) -> str:
-    l = '[' + ', '.join(float2str(n) for n in l) + ']'
-    string = '' 
+    tokens = [float2str(n) for n in l]
+    string = '[' + ', '.join(tokens) + ']'
+    lines = []
     last_end = -1
     last_com = 0
-    for i, element in enumerate(l):
-        if element == ',':
-            if i > (last_end + 1 + (LINE_SIZE - len(prefix))):
-                if last_end == -1:
-                    string += l[last_end + 1:last_com + 1] + '\n'
-                else:
-                    string += prefix + l[last_end + 2: last_com + 1] + '\n'
-                last_end = last_com
-            last_com = i
+    comma = 0
+    # the commas positions are computed from the tokens lengths instead of scanning every character
+    for k in range(len(tokens) - 1):
+        comma += len(tokens[k]) + (1 if k == 0 else 2)
+        if comma > (last_end + 1 + (LINE_SIZE - len(prefix))):
+            if last_end == -1:
+                lines.append(string[last_end + 1:last_com + 1])
+            else:
+                lines.append(prefix + string[last_end + 2: last_com + 1])
+            last_end = last_com
+        last_com = comma
     if last_end == -1:
-        string += l[last_end + 1:len(l)]
+        lines.append(string[last_end + 1:len(string)])
     else:
-        string += prefix + l[last_end + 2:len(l)]
-    return string
-
-# Convert a dict to string
-def generateFeaturesYAML(features: dict) -> str:
-    result = ''
+        lines.append(prefix + string[last_end + 2:len(string)])
+    return '\n'.join(lines)
+
+# Convert a feature dict to string
+def generateFeatureYAML(d: dict) -> str:
+    result = []
+    for i, (key2, value2) in enumerate(d.items()):
+        result.append(('- ' if i == 0 else '  ') + key2 + ': ')
+        if type(value2).__module__ == np.__name__:
+            value2 = value2.tolist()
+        if type(value2) != list:
+            result.append(str(value2) + '\n')
+        else:
+            if len(value2) == 0:
+                result.append('[]\n')
+            elif type(value2[0]) != list:
+                result.append(list2str(value2, '    ') + '\n')
+            else:
+                result.append('\n')
+                for elem in value2:
+                    result.append('  - ' + list2str(elem, '    ') + '\n')
+    if len(result) == 0:
+        result.append('- ')
+    return ''.join(result)
+
+def writeFeaturesYAML(f, features: dict):
+    """ Writes the features dict to an opened file, one feature at a time """
     for key, value in features.items():
         if len(value) == 0:
-            result += key + ': []\n'
+            f.write(key + ': []\n')
             continue
-        result += key + ':\n'
-        
-        while len(value) > 0:
-            d = value[0]
-            result += '- '
-            for key2, value2 in d.items():
-                if result[-2:] != '- ':
-                    result += '  '
-                result += key2 + ': '
-                if type(value2).__module__ == np.__name__:
-                    value2 = value2.tolist()
-                if type(value2) != list:
-                    result += str(value2) + '\n'
-                else:
-                    if len(value2) == 0:
-                        result += '[]\n'
-                    elif type(value2[0]) != list:
-                        result += list2str(value2, '    ') + '\n'
-                    else:
-                        result += '\n'
-                        for elem in value2:
-                            result += '  - ' + list2str(elem, '    ') + '\n'
-            value.pop(0)
-    return result
+        f.write(key + ':\n')
+        for d in value:
+            f.write(generateFeatureYAML(d))
+
+# Convert a dict to string
+def generateFeaturesYAML(features: dict) -> str:
+    buffer = io.StringIO()
+    writeFeaturesYAML(buffer, features)
+    return buffer.getvalue()
 
 def transforms2ListOfGpTrsf(R=np.eye(3,3), t=np.zeros(3), s=1.):
     transforms = [gp_Trsf(), gp_Trsf(), gp_Trsf()]
@@ -122,11 +135,12 @@ def compareDictsWithTolerance(dict1, dict2, tolerance=1e-6):
 
     return True
 
+YAML_BUFFER_SIZE = 2**20
+
 # Write features file
 def writeYAML(features_name: str, features: dict):
-    with open(features_name+".yaml", 'w') as f:
-        features_yaml = generateFeaturesYAML(features)
-        f.write(features_yaml)
+    with open(features_name+".yaml", 'w', buffering=YAML_BUFFER_SIZE) as f:
+        writeFeaturesYAML(f, features)
 
 def writeJSON(features_name: str, features: dict):
     with open(features_name+".json", 'w') as f:
@@ -136,11 +150,89 @@ def writePKL(features_name: str, features: dict):
     with open(features_name+".pkl", 'wb') as f:
         pickle.dump(features, f)
 
+def writeNPZ(features_name: str, features: dict, compact=False):
+    writeColumnar(features_name+".npz", features, compact=compact)
+
 YAML_NAMES = ['yaml', 'yml']
 JSON_NAMES = ['json']
 PKL_NAMES  = ['pkl']
+NPZ_NAMES  = ['npz']
+
+def iterFeatures(geometries_data: dict, key: str):
+    """ Yields the features dict of each geometry in geometries_data[key], releasing the geometry after it """
+    entities = geometries_data[key]
+    for i in range(len(entities)):
+        if entities[i] is not None and entities[i]['geometry'] is not None:
+            if entities[i].get('mesh_view') is not None:
+                entities[i]['mesh_view'].bind(entities[i]['geometry'])
+            feature = dict(entities[i]['geometry'].toDict())
+            if key == 'surfaces' and feature['face_indices'] is None:
+                print(feature)
+            entities[i] = None
+            yield feature
+            del feature
+
+def countFeatures(geometries_data: dict, key: str) -> int:
+    return sum(1 for entity in geometries_data[key] if entity is not None and entity['geometry'] is not None)
+
+# Write features file converting one geometry at a time, so they are never all held as dicts
+def writeYAMLStream(features_name: str, geometries_data: dict):
+    with open(features_name+".yaml", 'w', buffering=YAML_BUFFER_SIZE) as f:
+        for key in ['curves', 'surfaces']:
+            if countFeatures(geometries_data, key) == 0:
+                f.write(key + ': []\n')
+                continue
+            f.write(key + ':\n')
+            for feature in iterFeatures(geometries_data, key):
+                f.write(generateFeatureYAML(feature))
+
+def writeJSONStream(features_name: str, geometries_data: dict):
+    # same layout of json.dump(features, f, indent=4)
+    with open(features_name+".json", 'w') as f:
+        f.write('{')
+        for i, key in enumerate(['curves', 'surfaces']):
+            f.write(('\n' if i == 0 else ',\n') + ' '*4 + json.dumps(key) + ': [')
+            first = True
+            for feature in iterFeatures(geometries_data, key):
+                # newlines are always escaped inside json strings, only the layout ones are indented here
+                f.write(('\n' if first else ',\n') + ' '*8 + json.dumps(feature, indent=4).replace('\n', '\n' + ' '*8))
+                first = False
+            f.write(']' if first else '\n' + ' '*4 + ']')
+        f.write('\n}')
+
+def pickleBody(obj) -> bytes:
+    # protocol 2 memoizes with explicit indices, so independently pickled bodies can be concatenated
+    return pickle.dumps(obj, protocol=2)[2:-1]
+
+def writePKLStream(features_name: str, geometries_data: dict):
+    # same object loaded from the pickle of the features dict
+    with open(features_name+".pkl", 'wb') as f:
+        f.write(pickle.PROTO + bytes([2]) + pickle.EMPTY_DICT)
+        for key in ['curves', 'surfaces']:
+            f.write(pickleBody(key) + pickle.EMPTY_LIST)
+            for feature in iterFeatures(geometries_data, key):
+                f.write(pickleBody(feature) + pickle.APPEND)
+            f.write(pickle.SETITEM)
+        f.write(pickle.STOP)
+
+def writeFeaturesStream(features_name: str, geometries_data: dict, tp: str, compact=False):
+    """ Writes the features of geometries_data, the geometries are released while they are written.
+        compact stores the npz index and parameter arrays as int32 and float32 """
+    if tp.lower() in YAML_NAMES:
+        writeYAMLStream(f'{features_name}', geometries_data)
+    elif tp.lower() in PKL_NAMES:
+        writePKLStream(f'{features_name}', geometries_data)
+    elif tp.lower() in NPZ_NAMES:
+        # each feature is appended to the column buffers as it is converted, the columns are encoded at the end
+        builder = ColumnarBuilder(['curves', 'surfaces'], compact=compact)
+        for key in ['curves', 'surfaces']:
+            for feature in iterFeatures(geometries_data, key):
+                builder.add(key, feature)
+        writeColumnarArrays(f'{features_name}.npz', builder.arrays())
+    else:
+        writeJSONStream(f'{features_name}', geometries_data)
 
-def writeFeatures(features_name: str, features: dict, tp: str):
+def writeFeatures(features_name: str, features: dict, tp: str, compact=False):
     for feature in features['surfaces']:
         if feature['face_indices'] is None:
             print(feature)
@@ -148,13 +240,16 @@ def writeFeatures(features_name: str, features: dict, tp: str):
         writeYAML(f'{features_name}', features)
     elif tp.lower() in PKL_NAMES:
         writePKL(f'{features_name}', features)
+    elif tp.lower() in NPZ_NAMES:
+        writeNPZ(f'{features_name}', features, compact=compact)
     else:
         writeJSON(f'{features_name}', features)
 
 # Load features file
 def loadYAML(features_name: str):
     with open(features_name, 'r') as f:
-        data = yaml.load(f, Loader=yaml.Loader)
+        # libyaml loader when PyYAML was built with it
+        data = yaml.load(f, Loader=getattr(yaml, 'CLoader', yaml.Loader))
     return data
 
 def loadJSON(features_name: str):
@@ -167,11 +262,16 @@ def loadPKL(features_name: str):
         data = pickle.load(f)
     return data
 
+def loadNPZ(features_name: str, mmap=False):
+    return loadColumnar(features_name, mmap=mmap)
+
 def loadFeatures(features_name: str, tp: str):
     if tp.lower() in YAML_NAMES:
         return loadYAML(f'{features_name}.{tp}')
     elif tp.lower() in PKL_NAMES:
         return loadPKL(f'{features_name}.{tp}')
+    elif tp.lower() in NPZ_NAMES:
+        return loadNPZ(f'{features_name}.{tp}')
     else:
         return loadJSON(f'{features_name}.{tp}')
 
@@ -192,12 +292,28 @@ def filterFeaturesData(features_data, curve_types, surface_types):
         else:
             i+=1 
 
-def writeMeshPLY(filename, mesh):
-    o3d.io.write_triangle_mesh(filename + '.ply', mesh, print_progress=True, compressed=True)
+def writeMeshPLY(filename, mesh, vertex_properties=None, face_properties=None, compact=False):
+    """ Writes an open3d mesh (or a dict with vertices and faces) as binary PLY, with optional per-vertex
+        and per-face properties such as curve and surface labels. compact writes float vertices """
+    if isinstance(mesh, dict):
+        vertices, faces = np.asarray(mesh['vertices']), np.asarray(mesh['faces'])
+    else:
+        vertices, faces = np.asarray(mesh.vertices), np.asarray(mesh.triangles)
+    vertices = vertices.astype(np.float32 if compact else np.float64, copy=False)
+    writePLY(filename + '.ply', vertices, faces, vertex_properties=vertex_properties, face_properties=face_properties)
 
 def loadMeshPLY(filename):
     return o3d.io.read_triangle_mesh(str(filename) + '.ply', print_progress=True)
 
+def readMeshPLY(filename, mmap=True) -> dict:
+    """ Reads a PLY mesh as numpy arrays ({'vertices', 'faces'} and the stored properties), memory mapped
+        when it is binary little endian, through open3d otherwise """
+    try:
+        return readPLY(str(filename) + '.ply', mmap=mmap)
+    except ValueError:
+        mesh = loadMeshPLY(filename)
+        return {'vertices': np.asarray(mesh.vertices), 'faces': np.asarray(mesh.triangles)}
+
 def list_files(input_dir: str, formats: list, return_str=False) -> list:
     files = []
     path = Path(input_dir)
@@ -240,6 +356,9 @@ def rotation_matrix_from_vectors(vec1, vec2=np.array([0., 0., 1.])):
 def computeTranslationVector(vertices):
     bounding_box_min = np.min(vertices, axis=0).tolist()
     bounding_box_max = np.max(vertices, axis=0).tolist()
+    return computeTranslationFromBounds(bounding_box_min, bounding_box_max)
+
+def computeTranslationFromBounds(bounding_box_min, bounding_box_max):
     tx = - (bounding_box_max[0] + bounding_box_min[0]) * 0.5
     ty = - (bounding_box_max[1] + bounding_box_min[1]) * 0.5
     tz = - bounding_box_min[2]
@@ -247,6 +366,42 @@ def computeTranslationVector(vertices):
 
     return t
 
+NORMALIZATION_CHUNK_SIZE = 2**16
+
+def computeTransformedBounds(vertices, R, chunk_size=NORMALIZATION_CHUNK_SIZE):
+    """ Returns the bounding box of the rotated vertices without storing them """
+    bounding_box_min = np.full(3, np.inf)
+    bounding_box_max = np.full(3, -np.inf)
+    buffer = np.empty((min(chunk_size, len(vertices)), 3), dtype=np.float64)
+    for start in range(0, len(vertices), chunk_size):
+        chunk = vertices[start:(start + chunk_size)]
+        rotated = buffer[:len(chunk)]
+        np.matmul(chunk, R.T, out=rotated)
+        np.minimum(bounding_box_min, rotated.min(axis=0), out=bounding_box_min)
+        np.maximum(bounding_box_max, rotated.max(axis=0), out=bounding_box_max)
+    return bounding_box_min, bounding_box_max
+
+def normalizeVertices(vertices, R, s, dtype=None, chunk_size=NORMALIZATION_CHUNK_SIZE):
+    """ Rotates by R, translates (see computeTranslationVector) and scales by s the vertices with a single
+        fused affine transform applied in chunks. It is done in place, or in a new array when dtype differs.
+        Returns the vertices and the translation """
+    bounding_box_min, bounding_box_max = computeTransformedBounds(vertices, R, chunk_size=chunk_size)
+    t = computeTranslationFromBounds(bounding_box_min.tolist(), bounding_box_max.tolist())
+    A = s*R
+    b = s*t
+    if dtype is None or np.dtype(dtype) == vertices.dtype:
+        result = vertices
+    else:
+        result = np.empty(vertices.shape, dtype=dtype)
+    buffer = np.empty((min(chunk_size, len(vertices)), 3), dtype=np.float64)
+    for start in range(0, len(vertices), chunk_size):
+        chunk = vertices[start:(start + chunk_size)]
+        transformed = buffer[:len(chunk)]
+        np.matmul(chunk, A.T, out=transformed)
+        transformed += b
+        result[start:(start + len(chunk))] = transformed
+    return result, t
+
 def get_files_from_input_path(input_path):
     """ To get files from input path """
     if os.path.exists(input_path):
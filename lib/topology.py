@@ -0,0 +1,69 @@
+import numpy as np
+
+from OCC.Core.TopTools import TopTools_IndexedMapOfShape
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopAbs import TopAbs_VERTEX, TopAbs_EDGE
+
+def buildEntityMap(entities):
+    """ Indexes a list of shapes in a TopTools_IndexedMapOfShape (IsSame semantics).
+        Returns the map and the position in the list of each map index (1-based in OCC) """
+    entity_map = TopTools_IndexedMapOfShape()
+    positions = []
+    for position, entity in enumerate(entities):
+        entity_map.Add(entity)
+        if entity_map.Extent() > len(positions):
+            positions.append(position)
+    return entity_map, np.asarray(positions, dtype=np.int64)
+
+def findSubEntities(shape, sub_type, entity_map, positions):
+    """ Returns the list positions of the unique sub-shapes of shape, in exploration order, -1 when they are not indexed """
+    indices = []
+    seen = TopTools_IndexedMapOfShape()
+    explorer = TopExp_Explorer(shape, sub_type)
+    while explorer.More():
+        sub_entity = explorer.Current()
+        seen_before = seen.Extent()
+        seen.Add(sub_entity)
+        if seen.Extent() > seen_before:
+            map_index = entity_map.FindIndex(sub_entity)
+            indices.append(positions[map_index - 1] if map_index > 0 else -1)
+        explorer.Next()
+    return indices
+
+def buildAdjacency(entities, sub_type, sub_entity_map, sub_positions):
+    """ Returns the entity -> sub-entity adjacency in CSR format (indptr, indices) """
+    indptr = np.zeros(len(entities) + 1, dtype=np.int64)
+    indices = []
+    for i, entity in enumerate(entities):
+        sub_indices = findSubEntities(entity, sub_type, sub_entity_map, sub_positions)
+        indptr[i + 1] = indptr[i] + len(sub_indices)
+        indices += sub_indices
+    return indptr, np.asarray(indices, dtype=np.int64)
+
+def buildTopologyIndex(vertices, edges, faces):
+    """ Gives a dense id (the list position) to every vertex, edge and face in a single indexing pass,
+        and stores the face -> edges and edge -> vertices adjacency as CSR arrays """
+    vertices_map, vertices_positions = buildEntityMap(vertices)
+    edges_map, edges_positions = buildEntityMap(edges)
+    faces_map, faces_positions = buildEntityMap(faces)
+
+    edge_vertices_indptr, edge_vertices_indices = buildAdjacency(edges, TopAbs_VERTEX, vertices_map, vertices_positions)
+    face_edges_indptr, face_edges_indices = buildAdjacency(faces, TopAbs_EDGE, edges_map, edges_positions)
+
+    return {
+        'vertices_map': vertices_map,
+        'edges_map': edges_map,
+        'faces_map': faces_map,
+        'edge_vertices_indptr': edge_vertices_indptr,
+        'edge_vertices_indices': edge_vertices_indices,
+        'face_edges_indptr': face_edges_indptr,
+        'face_edges_indices': face_edges_indices,
+    }
+
+def getEdgeVertices(topology_index, edge_index):
+    indptr = topology_index['edge_vertices_indptr']
+    return topology_index['edge_vertices_indices'][indptr[edge_index]:indptr[edge_index + 1]]
+
+def getFaceEdges(topology_index, face_index):
+    indptr = topology_index['face_edges_indptr']
+    return topology_index['face_edges_indices'][indptr[face_index]:indptr[face_index + 1]]